@@ -0,0 +1,83 @@
+import json
+import os
+from typing import Iterator, List, Optional, Tuple
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "60"))
+RETRIES = int(os.getenv("API_RETRIES", "2"))
+CACHE_TTL = int(os.getenv("API_CACHE_TTL", "600"))
+POOL_SIZE = int(os.getenv("API_POOL_SIZE", "10"))
+
+
+class ApiError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=0,
+        status=RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def post(path: str, payload: dict, **kwargs) -> requests.Response:
+    return get_session().post(f"{API_URL}{path}", json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+
+
+def error_detail(response: requests.Response) -> str:
+    try:
+        return str(response.json().get("detail", response.text))
+    except ValueError:
+        return response.text
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False, max_entries=200)
+def check_cabinet(drugs: List[str], mode: str) -> dict:
+    response = post("/cabinet/check", {"drugs": drugs, "mode": mode})
+    if response.status_code != 200:
+        raise ApiError(response.status_code, error_detail(response))
+    return response.json()
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False, max_entries=200)
+def lookup_drug(drug_name: str, drug_dose: Optional[str], mode: str) -> dict:
+    response = post("/drugs/lookup", {"drug_name": drug_name, "drug_dose": drug_dose, "mode": mode})
+    if response.status_code != 200:
+        raise ApiError(response.status_code, error_detail(response))
+    return response.json()
+
+
+def stream_ask(payload: dict) -> Iterator[Tuple[str, dict]]:
+    with post("/ask/stream", payload, stream=True) as response:
+        if response.status_code != 200:
+            yield "error", {"detail": error_detail(response)}
+            return
+
+        response.encoding = response.encoding or "utf-8"
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                yield event, json.loads(line[len("data: "):])
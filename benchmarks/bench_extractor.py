@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from extractor import drug_extractor, heuristic_extract
+from knowledge import phrase_key
+
+CASES_FILE = os.path.join("benchmarks", "extraction_cases.json")
+
+
+def score(extract, cases):
+    true_positives = 0
+    predicted = 0
+    expected = 0
+    covered = 0
+    for case in cases:
+        found = {phrase_key(d) for d in extract(case["query"])}
+        gold = {phrase_key(d) for d in case["expected"]}
+        true_positives += len(found & gold)
+        predicted += len(found)
+        expected += len(gold)
+        covered += 1 if found else 0
+
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "non_empty_rate": covered / len(cases)}
+
+
+def llm_call_rate(cases):
+    calls = 0
+    for case in cases:
+        found, leftovers = drug_extractor.extract_with_leftovers(case["query"])
+        calls += 1 if not found or leftovers else 0
+    return calls / len(cases)
+
+
+def latency(extract, cases, repeat):
+    for case in cases:
+        extract(case["query"])
+
+    samples = []
+    for _ in range(repeat):
+        for case in cases:
+            start = time.perf_counter()
+            extract(case["query"])
+            samples.append((time.perf_counter() - start) * 1e6)
+
+    samples.sort()
+    return {
+        "mean_us": statistics.mean(samples),
+        "p50_us": samples[len(samples) // 2],
+        "p99_us": samples[int(len(samples) * 0.99) - 1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precyzja, czułość i opóźnienie ekstrakcji leków bez LLM.")
+    parser.add_argument("--cases", default=CASES_FILE)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--output", help="Zapisz wyniki do pliku JSON")
+    args = parser.parse_args()
+
+    with open(args.cases, "r", encoding="utf-8") as f:
+        cases = json.load(f)
+
+    results = {}
+    for name, extract in [("dictionary", drug_extractor.extract), ("heuristic", heuristic_extract)]:
+        results[name] = {**score(extract, cases), **latency(extract, cases, args.repeat)}
+    results["dictionary"]["llm_call_rate"] = llm_call_rate(cases)
+
+    print(f"{'ekstraktor':<12}{'precision':>10}{'recall':>10}{'f1':>10}{'non-empty':>11}{'mean µs':>10}{'p50 µs':>10}{'p99 µs':>10}{'llm-call':>10}")
+    for name, r in results.items():
+        llm_calls = f"{r['llm_call_rate']:.2f}" if "llm_call_rate" in r else "-"
+        print(f"{name:<12}{r['precision']:>10.2f}{r['recall']:>10.2f}{r['f1']:>10.2f}{r['non_empty_rate']:>11.2f}"
+              f"{r['mean_us']:>10.1f}{r['p50_us']:>10.1f}{r['p99_us']:>10.1f}{llm_calls:>10}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"cases": len(cases), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
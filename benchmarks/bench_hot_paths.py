@@ -0,0 +1,242 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+
+from guards import SecurityGuard
+from rag import MedicalRAG, normalize_rows
+from tools import IdentifyDrugArgs, ToolRegistry, best_candidate
+
+DIMENSION = 384
+WORDS = ["lek", "tabletka", "dawka", "ryzyko", "interakcja", "wątroba", "nerki", "alkohol", "ciśnienie", "serce",
+         "krwawienie", "senność", "ból", "gorączka", "zapalenie", "układ", "nerwowy", "stosować", "ostrożnie", "lekarz"]
+NAMES = ["Apap", "Ibuprom", "Tramal", "Doreta", "Xanax", "Warfin", "Polopiryna", "Nurofen", "Ketonal", "Metformax"]
+SUBSTANCES = ["paracetamolum", "ibuprofenum", "tramadoli hydrochloridum", "alprazolamum", "warfarinum natricum",
+              "acidum acetylsalicylicum", "ketoprofenum", "metformini hydrochloridum"]
+POWERS = ["50 mg", "200 mg", "400 mg", "500 mg", "0,5 mg", "37,5 mg + 325 mg", "1 g", "10 mg/ml"]
+
+SCALES = {
+    "quick": {"corpus": [1000, 10000], "candidates": [25, 100], "query_chars": [100, 1000], "context_chars": [1000, 3000]},
+    "full": {"corpus": [1000, 10000, 100000], "candidates": [10, 25, 100, 500], "query_chars": [50, 500, 5000],
+             "context_chars": [1000, 3000, 12000]}
+}
+
+REPAIR_CASES = [
+    ('```json\n{"answer": "INTERAKCJA: Ryzyko krwawienia.", "interakcja": true,}\n```', True),
+    ("{'answer': 'BEZPIECZNIE: Można stosować razem.'}", False),
+    ("**INTERAKCJA:** Nie łączyć z alkoholem.", True),
+    ("Bezpieczniej jest nie łączyć tych leków, ryzyko krwawienia.", None),
+    ("Interakcje są możliwe, skonsultuj się z lekarzem.", None)
+]
+
+
+class SyntheticEncoder:
+    def __init__(self, seed: int):
+        self.rng = np.random.default_rng(seed)
+
+    def get_sentence_embedding_dimension(self):
+        return DIMENSION
+
+    def encode(self, texts, show_progress_bar=False, **kwargs):
+        return self.rng.standard_normal((len(texts), DIMENSION)).astype("float32")
+
+
+def sentence(rng: random.Random, chars: int) -> str:
+    words = []
+    while sum(len(w) + 1 for w in words) < chars:
+        words.append(rng.choice(WORDS + NAMES))
+    return " ".join(words)[:chars]
+
+
+def synthetic_rag(size: int, seed: int) -> MedicalRAG:
+    rng = random.Random(seed)
+    rag = MedicalRAG(knowledge_file=os.devnull)
+    rag._model = SyntheticEncoder(seed)
+    rag.chunks = [f"ID: DOC_{i} Nazwa: {rng.choice(NAMES)} Ostrzeżenia: {sentence(rng, 200)}" for i in range(size)]
+    rag.index = rag.build_index(normalize_rows(rag.model.encode(rag.chunks)))
+    return rag
+
+
+def synthetic_candidates(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [{
+        "medicinalProductName": f"{rng.choice(NAMES)} {rng.choice(['Forte', 'Max', 'Extra', ''])}".strip(),
+        "commonName": rng.choice(SUBSTANCES),
+        "medicinalProductPower": rng.choice(POWERS),
+        "pharmaceuticalFormName": "Tabletki",
+        "atcCode": "N02BE01"
+    } for _ in range(count)]
+
+
+def synthetic_context(chars: int, seed: int) -> str:
+    rng = random.Random(seed)
+    parts = []
+    i = 0
+    while sum(len(p) for p in parts) < chars:
+        parts.append(f"[Źródło ID:{i}] ID: DOC_{i}\nNazwa: {rng.choice(NAMES)}\nOstrzeżenia: {sentence(rng, 250)}")
+        i += 1
+    return "\n".join(parts)
+
+
+def measure(func, min_time: float, max_calls: int) -> dict:
+    func()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_calls and (time.perf_counter() - started < min_time or len(samples) < 5):
+        call_started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - call_started) * 1e6)
+
+    samples.sort()
+    return {
+        "calls": len(samples),
+        "mean_us": round(statistics.mean(samples), 2),
+        "p50_us": round(samples[len(samples) // 2], 2),
+        "p95_us": round(samples[min(len(samples) - 1, math.ceil(len(samples) * 0.95) - 1)], 2),
+        "min_us": round(samples[0], 2)
+    }
+
+
+def cases(scales: dict, seed: int):
+    rng = random.Random(seed)
+
+    for size in scales["corpus"]:
+        rag = synthetic_rag(size, seed)
+        query = sentence(rng, 80)
+        yield "rag.search_records", f"corpus={size},k=15", lambda rag=rag, query=query: rag.search_records(query, k=15)
+        query_vector = normalize_rows(rag.model.encode([query]))
+        for fetch in [30, 100]:
+            _, indices = rag.index.search(query_vector, min(fetch, size))
+            yield "rag._mmr", f"corpus={size},candidates={fetch},k=15", \
+                lambda rag=rag, qv=query_vector, idx=indices[0]: rag._mmr(qv, idx, 15, 0.5)
+
+    for count in scales["candidates"]:
+        candidates = synthetic_candidates(count, seed)
+        yield "tools.best_candidate", f"candidates={count}", \
+            lambda candidates=candidates: best_candidate("Apap", "500 mg", candidates)
+
+    for chars in scales["query_chars"]:
+        text = sentence(rng, chars) + " jan.kowalski@example.com 90010112345"
+        yield "SecurityGuard.check_injection", f"chars={chars}", lambda text=text: SecurityGuard.check_injection(text)
+        yield "SecurityGuard.sanitize_input", f"chars={chars}", lambda text=text: SecurityGuard.sanitize_input(text)
+
+    for i, (text, _) in enumerate(REPAIR_CASES):
+        yield "SecurityGuard.repair_json", f"case={i}", lambda text=text: SecurityGuard.repair_json(text)
+
+    from main import local_llm_stub
+    tool_result = "\n".join(
+        "Dane z Rejestru: " + json.dumps({"name": c["medicinalProductName"], "substance": c["commonName"],
+                                         "power": c["medicinalProductPower"], "form": "Tabletki",
+                                         "indications": sentence(rng, 200)}, ensure_ascii=False)
+        for c in synthetic_candidates(3, seed)
+    )
+    for chars in scales["context_chars"]:
+        context = synthetic_context(chars, seed)
+        yield "local_llm_stub", f"context_chars={chars}", \
+            lambda context=context: local_llm_stub("Czy mogę brać Apap z Ibupromem?", context, tool_result)
+
+    registry = ToolRegistry()
+    noop = lambda drug_name, drug_dose=None, mode="groq": "Dane z Rejestru: {}"
+    registry._tools["noop"] = {"func": noop, "args_model": IdentifyDrugArgs}
+    arguments = {"drug_name": "Apap", "drug_dose": "500 mg", "mode": "groq"}
+    yield "ToolRegistry.validate_and_execute", "noop", lambda: registry.validate_and_execute("noop", arguments)
+    yield "ToolRegistry.validate_and_execute", "direct_call", lambda: noop(**arguments)
+
+
+def check_repairs() -> list:
+    failures = []
+    for text, expected in REPAIR_CASES:
+        repaired = SecurityGuard.repair_json(text)
+        verdict = json.loads(repaired)["interakcja"] if repaired else None
+        if verdict != expected:
+            failures.append(f"{text!r}: {verdict} zamiast {expected}")
+    return failures
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(baseline: dict, results: list, threshold: float) -> list:
+    previous = {(r["name"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nPorównanie z {baseline['meta'].get('revision') or 'poprzednim przebiegiem'} (p50):")
+    for r in results:
+        old = previous.get((r["name"], r["scale"]))
+        if old is None:
+            continue
+        ratio = r["p50_us"] / old["p50_us"] if old["p50_us"] else 1.0
+        flag = ratio > 1 + threshold
+        print(f"- {r['name']} [{r['scale']}]: {old['p50_us']:.1f} -> {r['p50_us']:.1f} µs (x{ratio:.2f}){' REGRESJA' if flag else ''}")
+        if flag:
+            regressions.append(f"{r['name']} [{r['scale']}]")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mikro-benchmarki gorących ścieżek na syntetycznych danych w kilku skalach.")
+    parser.add_argument("--scale", choices=list(SCALES), default="quick")
+    parser.add_argument("--only", help="Uruchom tylko funkcje, których nazwa zawiera ten tekst")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Minimalny czas pomiaru jednego przypadku w sekundach")
+    parser.add_argument("--max-calls", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Zapisz wyniki do pliku JSON")
+    parser.add_argument("--baseline", help="Plik JSON z poprzedniego przebiegu do porównania")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Dopuszczalny wzrost p50 (ułamek)")
+    args = parser.parse_args()
+
+    failures = check_repairs()
+    if failures:
+        print("Błędna naprawa JSON:\n" + "\n".join(failures))
+        sys.exit(1)
+
+    results = []
+    print(f"{'funkcja':<36}{'skala':<34}{'p50 µs':>12}{'p95 µs':>12}{'wywołania':>11}")
+    for name, scale, func in cases(SCALES[args.scale], args.seed):
+        if args.only and args.only not in name:
+            continue
+        r = {"name": name, "scale": scale, **measure(func, args.min_time, args.max_calls)}
+        results.append(r)
+        print(f"{name:<36}{scale:<34}{r['p50_us']:>12.1f}{r['p95_us']:>12.1f}{r['calls']:>11}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "scale": args.scale,
+            "seed": args.seed
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"Wykryto regresje: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
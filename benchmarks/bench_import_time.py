@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["main", "tools", "rag"]
+HEAVY_MODULES = ["google.genai", "groq", "sentence_transformers", "torch", "faiss", "transformers"]
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=ROOT).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def parse_importtime(stderr: str) -> dict:
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if len(parts) == 3 and parts[1].isdigit():
+            cumulative[parts[2]] = int(parts[1])
+    return cumulative
+
+
+def measure(module: str, runs: int, top: int) -> dict:
+    env = {**os.environ, "HF_HUB_OFFLINE": "1", "WARMUP": "0"}
+    samples = []
+    heavy = set()
+    slowest = {}
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                              capture_output=True, text=True, cwd=ROOT, env=env)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Import {module} nie powiódł się:\n{proc.stderr[-2000:]}")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        samples.append(result["seconds"] * 1000)
+        heavy.update(result["heavy"])
+        for name, us in parse_importtime(proc.stderr).items():
+            if name.strip() not in (module, "site"):
+                slowest[name.strip()] = max(slowest.get(name.strip(), 0), us)
+
+    top_level = {name: us for name, us in slowest.items() if "." not in name}
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": round(statistics.median(samples), 1),
+        "min_ms": round(min(samples), 1),
+        "max_ms": round(max(samples), 1),
+        "heavy_loaded": sorted(heavy),
+        "slowest_imports_ms": {name: round(us / 1000, 1) for name, us in
+                               sorted(top_level.items(), key=lambda item: -item[1])[:top]}
+    }
+
+
+def compare(baseline: dict, results: list, threshold: float) -> list:
+    previous = {r["module"]: r for r in baseline["results"]}
+    regressions = []
+    print(f"\nPorównanie z {baseline['meta'].get('revision') or 'poprzednim przebiegiem'} (mediana):")
+    for r in results:
+        old = previous.get(r["module"])
+        if old is None:
+            continue
+        ratio = r["median_ms"] / old["median_ms"] if old["median_ms"] else 1.0
+        flag = ratio > 1 + threshold
+        print(f"- {r['module']}: {old['median_ms']:.0f} -> {r['median_ms']:.0f} ms (x{ratio:.2f}){' REGRESJA' if flag else ''}")
+        if flag:
+            regressions.append(r["module"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Czas importu modułów backendu w świeżym interpreterze (python -X importtime).")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="Liczba najwolniejszych importów do wypisania")
+    parser.add_argument("--allow-heavy", action="store_true", help="Nie traktuj załadowania ciężkich SDK jako błędu")
+    parser.add_argument("--output", help="Zapisz wyniki do pliku JSON")
+    parser.add_argument("--baseline", help="Plik JSON z poprzedniego przebiegu do porównania")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Dopuszczalny wzrost mediany (ułamek)")
+    args = parser.parse_args()
+
+    results = []
+    failed = []
+    for module in args.modules:
+        r = measure(module, args.runs, args.top)
+        results.append(r)
+        print(f"{module}: mediana {r['median_ms']:.0f} ms (min {r['min_ms']:.0f}, max {r['max_ms']:.0f}, {r['runs']} przebiegów)")
+        for name, ms in r["slowest_imports_ms"].items():
+            print(f"  {name:<30}{ms:>10.1f} ms")
+        if r["heavy_loaded"]:
+            print(f"  Załadowane ciężkie moduły: {', '.join(r['heavy_loaded'])}")
+            failed.append(module)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine()
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    status = 0
+    if failed and not args.allow_heavy:
+        print(f"Import ładuje ciężkie SDK przy starcie: {', '.join(failed)}")
+        status = 1
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"Wykryto regresje: {', '.join(regressions)}")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import argparse
+import atexit
+import json
+import math
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from fake_rpl_server import SEARCH_PATH, FaultConfig, start_server
+from fake_rpl_server import make_handler as make_rpl_handler
+from fake_llm_server import LLMConfig
+from fake_llm_server import make_handler as make_llm_handler
+
+CASES_FILE = "test_cases.json"
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def summarize(values):
+    return {
+        "mean_ms": round(statistics.mean(values), 2),
+        "p50_ms": round(percentile(values, 0.5), 2),
+        "p95_ms": round(percentile(values, 0.95), 2),
+        "p99_ms": round(percentile(values, 0.99), 2)
+    }
+
+
+def configure_environment(args, workdir: str):
+    rpl = start_server(make_rpl_handler(FaultConfig(args.rpl_latency_ms, args.rpl_jitter_ms, 0.0, 0.0, 0.0,
+                                                    distribution=args.distribution, seed=args.seed)))
+    llm = start_server(make_llm_handler(LLMConfig(args.llm_latency_ms, args.llm_jitter_ms, 0.0, 0.0, 0.0,
+                                                  distribution=args.distribution, seed=args.seed,
+                                                  ttft_ms=args.llm_latency_ms, token_ms=0.0)))
+    llm_url = f"http://127.0.0.1:{llm.server_port}"
+    os.environ.update({
+        "RPL_API_URL": f"http://127.0.0.1:{rpl.server_port}{SEARCH_PATH}",
+        "GROQ_BASE_URL": llm_url,
+        "GEMINI_BASE_URL": llm_url,
+        "GROQ_API_KEY": "bench",
+        "GEMINI_API_KEY": "bench",
+        "GROQ_RPM": "1000000",
+        "GROQ_TPM": "1000000000",
+        "GEMINI_RPM": "1000000",
+        "GEMINI_TPM": "1000000000",
+        "LOG_CSV_PATH": os.path.join(workdir, "logs_aggregate.csv"),
+        "REGISTRY_CACHE_FILE": os.path.join(workdir, "registry_cache.json"),
+        "EXTRACTION_CACHE_FILE": os.path.join(workdir, "extraction_cache.json"),
+        "EXTRACTION_ALIAS_FILE": os.path.join(workdir, "extraction_aliases.json"),
+        "PROFILE_DIR": os.path.join(workdir, "profiles")
+    })
+    return rpl, llm
+
+
+def clear_caches():
+    import main
+    import extractor
+    import tools
+    for cache in [main.pair_cache, extractor.extraction_cache, tools.registry_cache]:
+        cache.clear()
+
+
+def run_queries(client, cases, args, samples, lock):
+    for case in cases:
+        payload = {"query": case["query"], "mode": args.mode, "json_mode": case.get("json_mode", False), "trace": True}
+        start = time.perf_counter()
+        response = client.post("/ask", json=payload)
+        elapsed = (time.perf_counter() - start) * 1000
+        data = response.json() if response.status_code == 200 else {}
+        with lock:
+            samples.append({"type": case["type"], "status": response.status_code, "latency_ms": elapsed,
+                            "timings": data.get("timings") or {}})
+
+
+def run(args, cases):
+    from fastapi.testclient import TestClient
+    import main
+
+    samples = []
+    lock = threading.Lock()
+    clients = [TestClient(main.app) for _ in range(args.concurrency)]
+
+    run_queries(clients[0], cases, args, [], lock)
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        if args.cold:
+            clear_caches()
+        threads = [
+            threading.Thread(target=run_queries, args=(client, cases[i::args.concurrency], args, samples, lock))
+            for i, client in enumerate(clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    main.csv_log.flush()
+    return samples, elapsed
+
+
+def report(samples, elapsed):
+    ok = [s for s in samples if s["status"] == 200]
+    stages = {}
+    for sample in ok:
+        for stage, duration in sample["timings"].items():
+            stages.setdefault(stage, []).append(duration)
+
+    by_type = {}
+    for sample in samples:
+        by_type.setdefault(sample["type"], []).append(sample["latency_ms"])
+
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "throughput_rps": round(len(samples) / elapsed, 2),
+        "latency": summarize([s["latency_ms"] for s in samples]),
+        "by_type": {case_type: summarize(values) for case_type, values in sorted(by_type.items())},
+        "stages": {stage: summarize(values) for stage, values in sorted(stages.items(), key=lambda item: item[0] == "total")}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pomiar narzutu potoku /ask na lokalnych atrapach RPL i LLM (bez sieci).")
+    parser.add_argument("--cases", default=CASES_FILE)
+    parser.add_argument("--mode", default="groq", choices=["groq", "gemini", "local"])
+    parser.add_argument("--repeat", type=int, default=20, help="Liczba przebiegów przez wszystkie przypadki")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--cold", action="store_true", help="Czyść cache przed każdym przebiegiem")
+    parser.add_argument("--rpl-latency-ms", type=float, default=0.0)
+    parser.add_argument("--rpl-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--distribution", default="fixed", choices=["fixed", "uniform", "lognormal", "exponential"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Zapisz wyniki do pliku JSON")
+    args = parser.parse_args()
+
+    with open(args.cases, "r", encoding="utf-8") as f:
+        cases = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="kyp-bench-")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    configure_environment(args, workdir)
+    samples, elapsed = run(args, cases)
+    results = report(samples, elapsed)
+
+    print(f"Zapytania: {results['requests']} (200 OK: {results['ok']}), {results['throughput_rps']} zapytań/s")
+    print(f"{'etap':<20}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in [("klient", results["latency"])] + list(results["stages"].items()):
+        print(f"{name:<20}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import faiss
+import numpy as np
+
+from rag import STORAGES, MedicalRAG, normalize_rows
+
+DIMENSION = 384
+LATENT_DIMENSION = 32
+
+
+def synthetic_corpus(size: int, queries: int, seed: int):
+    rng = np.random.default_rng(seed)
+    projection = rng.standard_normal((LATENT_DIMENSION, DIMENSION)).astype("float32")
+    centers = rng.standard_normal((max(1, int(size ** 0.5)), LATENT_DIMENSION)).astype("float32")
+    latent = centers[rng.integers(0, len(centers), size)] + rng.standard_normal((size, LATENT_DIMENSION)).astype("float32")
+    corpus = latent @ projection + 0.1 * rng.standard_normal((size, DIMENSION)).astype("float32")
+    picks = latent[rng.integers(0, size, queries)] + 0.5 * rng.standard_normal((queries, LATENT_DIMENSION)).astype("float32")
+    return normalize_rows(corpus), normalize_rows(picks @ projection)
+
+
+def knowledge_corpus(cases_file: str):
+    rag = MedicalRAG()
+    with open(rag.knowledge_file, "r", encoding="utf-8") as f:
+        chunks = [line.strip() for line in f if line.strip()]
+    with open(cases_file, "r", encoding="utf-8") as f:
+        queries = [case["query"] for case in json.load(f)]
+    return normalize_rows(rag.model.encode(chunks)), normalize_rows(rag.model.encode(queries))
+
+
+def overlap(found, expected, k: int) -> float:
+    return len(set(int(i) for i in found[:k]) & set(int(i) for i in expected[:k])) / k
+
+
+def evaluate(corpus: np.ndarray, queries: np.ndarray, k: int, mmr_queries: int) -> list:
+    fetch_k = min(2 * k, len(corpus))
+    k = min(k, len(corpus))
+    legacy = faiss.IndexFlatL2(corpus.shape[1])
+    legacy.add(corpus)
+    legacy_bytes = corpus.nbytes + len(faiss.serialize_index(legacy))
+
+    results = []
+    baseline = None
+    for storage in STORAGES:
+        rag = MedicalRAG(knowledge_file=os.devnull, storage=storage)
+        started = time.perf_counter()
+        rag.index = rag.build_index(corpus)
+        build_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        _, indices = rag.index.search(queries, fetch_k)
+        search_us = (time.perf_counter() - started) / len(queries) * 1e6
+        selections = [rag._mmr(queries[i:i + 1], indices[i], k, 0.5) for i in range(min(mmr_queries, len(queries)))]
+        if baseline is None:
+            baseline = (indices, selections)
+
+        results.append({
+            "storage": storage,
+            "index_type": type(rag.index).__name__,
+            "index_mb": round(len(faiss.serialize_index(rag.index)) / 2 ** 20, 2),
+            "legacy_mb": round(legacy_bytes / 2 ** 20, 2),
+            "build_s": round(build_s, 3),
+            "search_us_per_query": round(search_us, 1),
+            f"recall@{k}": round(float(np.mean([overlap(found, expected, k) for found, expected in zip(indices, baseline[0])])), 4),
+            f"mmr_recall@{k}": round(float(np.mean([overlap(found, expected, k) for found, expected in zip(selections, baseline[1])])), 4)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pamięć i recall@k indeksu RAG dla float32, float16 i pq względem float32.")
+    parser.add_argument("--source", choices=["synthetic", "knowledge"], default="synthetic",
+                        help="synthetic: skupione wektory o niskim wymiarze wewnętrznym; knowledge: knowledge.txt i zapytania z test_cases.json (model embeddingów)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--mmr-queries", type=int, default=200, help="Liczba zapytań, dla których porównywany jest wynik MMR")
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--cases", default="test_cases.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-recall", type=float, default=0.0, help="Zakończ błędem, gdy recall@k któregoś wariantu jest niższy")
+    parser.add_argument("--output", help="Zapisz wyniki do pliku JSON")
+    args = parser.parse_args()
+
+    if args.source == "knowledge":
+        corpora = [("knowledge", *knowledge_corpus(args.cases))]
+    else:
+        corpora = [(f"synthetic={size}", *synthetic_corpus(size, args.queries, args.seed)) for size in args.sizes]
+
+    report = []
+    failed = []
+    for name, corpus, queries in corpora:
+        results = evaluate(corpus, queries, args.k, args.mmr_queries)
+        report.append({"corpus": name, "size": len(corpus), "queries": len(queries), "results": results})
+        print(f"\n{name}: {len(corpus)} wektorów, {len(queries)} zapytań, poprzednio (macierz + IndexFlatL2) "
+              f"{results[0]['legacy_mb']:.2f} MB")
+        print(f"{'wariant':<10}{'indeks':<24}{'MB':>10}{'µs/zapyt.':>12}{'recall@k':>10}{'MMR@k':>8}")
+        for r in results:
+            recall, mmr_recall = r[f"recall@{min(args.k, len(corpus))}"], r[f"mmr_recall@{min(args.k, len(corpus))}"]
+            print(f"{r['storage']:<10}{r['index_type']:<24}{r['index_mb']:>10.2f}{r['search_us_per_query']:>12.1f}"
+                  f"{recall:>10.4f}{mmr_recall:>8.4f}")
+            if recall < args.min_recall:
+                failed.append(f"{name}/{r['storage']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": report}, f, indent=2)
+    if failed:
+        print(f"Recall@k poniżej {args.min_recall}: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
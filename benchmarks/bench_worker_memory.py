@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY_MARKER = "Rozgrzewka zakończona"
+
+
+def read_memory(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return {
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "uss_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1)
+    }
+
+
+def descendants(pid: int) -> list:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    result = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            result.append(child)
+            stack.append(child)
+    return result
+
+
+def command_line(pid: int) -> str:
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+
+
+def wait_for(predicate, timeout: float, what: str, log_path: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return
+        time.sleep(0.5)
+    with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+        tail = f.read()[-3000:]
+    raise RuntimeError(f"Nie doczekano się: {what}\n{tail}")
+
+
+def start(args: list, env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", *args], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_mode(mode: str, args, workdir: str) -> dict:
+    env = {
+        **os.environ,
+        "WARMUP": "1",
+        "LOG_CSV_PATH": os.path.join(workdir, "logs_aggregate.csv"),
+        "REGISTRY_CACHE_FILE": os.path.join(workdir, "registry_cache.json"),
+        "EXTRACTION_CACHE_FILE": os.path.join(workdir, "extraction_cache.json"),
+        "EXTRACTION_ALIAS_FILE": os.path.join(workdir, "extraction_aliases.json"),
+        "PROFILE_DIR": os.path.join(workdir, "profiles")
+    }
+    env.pop("RAG_SERVER_URL", None)
+    processes = []
+    rows = []
+    try:
+        if mode == "remote":
+            rag_url = f"http://127.0.0.1:{args.rag_port}"
+            env["RAG_SERVER_URL"] = rag_url
+            rag_log = os.path.join(workdir, "rag_server.log")
+            rag_server = start(["rag_server:app", "--port", str(args.rag_port)], env, rag_log)
+            processes.append(rag_server)
+
+            def rag_ready():
+                try:
+                    return requests.get(f"{rag_url}/health", timeout=1).json().get("indexed")
+                except (requests.RequestException, ValueError):
+                    return False
+
+            wait_for(rag_ready, args.timeout, "serwer RAG", rag_log)
+            rows.append({"process": "rag_server", "pid": rag_server.pid, **read_memory(rag_server.pid)})
+
+        api_log = os.path.join(workdir, f"api_{mode}.log")
+        api = start(["main:app", "--port", str(args.port), "--workers", str(args.workers)], env, api_log)
+        processes.append(api)
+
+        def workers_ready():
+            with open(api_log, "r", encoding="utf-8", errors="replace") as f:
+                return f.read().count(READY_MARKER) >= args.workers
+
+        wait_for(workers_ready, args.timeout, f"rozgrzewka {args.workers} workerów", api_log)
+        time.sleep(args.settle)
+        rows.append({"process": "uvicorn", "pid": api.pid, **read_memory(api.pid)})
+        for pid in descendants(api.pid):
+            if "resource_tracker" in command_line(pid):
+                continue
+            rows.append({"process": "worker", "pid": pid, **read_memory(pid)})
+    finally:
+        for process in reversed(processes):
+            stop(process)
+
+    workers = [r for r in rows if r["process"] == "worker"]
+    return {
+        "mode": mode,
+        "processes": rows,
+        "total_pss_mb": round(sum(r["pss_mb"] for r in rows), 1),
+        "worker_pss_mb": round(sum(r["pss_mb"] for r in workers) / max(1, len(workers)), 1),
+        "worker_uss_mb": round(sum(r["uss_mb"] for r in workers) / max(1, len(workers)), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pamięć workerów uvicorn z lokalnym RAG i ze wspólnym serwerem RAG (Linux, /proc).")
+    parser.add_argument("--mode", choices=["local", "remote", "both"], default="both")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--rag-port", type=int, default=8011)
+    parser.add_argument("--timeout", type=float, default=300, help="Maksymalny czas oczekiwania na rozgrzewkę w sekundach")
+    parser.add_argument("--settle", type=float, default=2, help="Odczekanie po rozgrzewce przed pomiarem w sekundach")
+    parser.add_argument("--output", help="Zapisz wyniki do pliku JSON")
+    args = parser.parse_args()
+
+    modes = ["local", "remote"] if args.mode == "both" else [args.mode]
+    results = {}
+    for mode in modes:
+        workdir = tempfile.mkdtemp(prefix="kyp-mem-")
+        try:
+            results[mode] = run_mode(mode, args, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        r = results[mode]
+        print(f"\nTryb {mode}, {args.workers} workerów:")
+        print(f"{'proces':<14}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}")
+        for p in r["processes"]:
+            print(f"{p['process']:<14}{p['pid']:>8}{p['rss_mb']:>10.1f}{p['pss_mb']:>10.1f}{p['uss_mb']:>10.1f}")
+        print(f"Razem PSS: {r['total_pss_mb']:.1f} MB, na workera: PSS {r['worker_pss_mb']:.1f} MB, USS {r['worker_uss_mb']:.1f} MB")
+
+    if len(results) == 2:
+        local, remote = results["local"], results["remote"]
+        print(f"\nOszczędność: {local['total_pss_mb'] - remote['total_pss_mb']:.1f} MB łącznie, "
+              f"{local['worker_pss_mb'] - remote['worker_pss_mb']:.1f} MB PSS na workera")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from fake_rpl_server import CONTROL_PATH, FaultConfig, add_fault_args
+
+STOPWORDS = {"czy", "mogę", "moge", "można", "brać", "łączyć", "razem", "oraz", "jest", "bezpieczne", "jaka", "jakie"}
+ANSWER = ("INTERAKCJA: Jednoczesne stosowanie {drugs} może nasilać działania niepożądane. "
+          "Przed połączeniem tych leków skonsultuj się z lekarzem lub farmaceutą.")
+SAFE_ANSWER = "BEZPIECZNIE: W dostarczonych danych nie znaleziono interakcji. W razie wątpliwości zapytaj farmaceutę."
+DESCRIPTION = "Lek stosowany zgodnie z Charakterystyką Produktu Leczniczego. Opis wygenerowany przez lokalny serwer testowy."
+
+
+class LLMConfig(FaultConfig):
+    def __init__(self, *args, ttft_ms: float = 0.0, token_ms: float = 0.0, chunk_chars: int = 12, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ttft_ms = ttft_ms
+        self.token_ms = token_ms
+        self.chunk_chars = chunk_chars
+
+    def update(self, values: dict):
+        super().update(values)
+        with self.lock:
+            for name in ["ttft_ms", "token_ms"]:
+                if name in values:
+                    setattr(self, name, float(values[name]))
+
+    def as_dict(self) -> dict:
+        return {**super().as_dict(), "ttft_ms": self.ttft_ms, "token_ms": self.token_ms}
+
+
+def query_drugs(prompt: str) -> list:
+    query = prompt.rsplit("Zapytanie:", 1)[-1].rsplit("Pytanie:", 1)[-1]
+    words = re.findall(r"[A-ZĄĆĘŁŃÓŚŹŻ][\wąćęłńóśźż-]{2,}", query)
+    return [w for w in dict.fromkeys(words) if w.lower() not in STOPWORDS]
+
+
+def canned_reply(prompt: str, json_mode: bool) -> str:
+    if prompt.startswith("Wypisz"):
+        return ", ".join(query_drugs(prompt))
+    if prompt.startswith("Podaj krótki"):
+        return DESCRIPTION
+    if prompt.startswith("Zwróciłeś błędny JSON"):
+        json_mode = True
+
+    drugs = query_drugs(prompt)
+    answer = ANSWER.format(drugs=" i ".join(drugs)) if len(drugs) > 1 else SAFE_ANSWER
+    if json_mode or "formacie JSON" in prompt:
+        return json.dumps({"answer": answer, "interakcja": answer.startswith("INTERAKCJA")}, ensure_ascii=False)
+    return answer
+
+
+def chunks(text: str, size: int) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def usage(prompt: str, text: str) -> tuple:
+    prompt_tokens = max(1, len(prompt) // 4)
+    completion_tokens = max(1, len(text) // 4)
+    return prompt_tokens, completion_tokens
+
+
+def openai_completion(model: str, text: str, prompt: str) -> dict:
+    prompt_tokens, completion_tokens = usage(prompt, text)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens}
+    }
+
+
+def openai_chunk(completion_id: str, model: str, content: str, finish_reason=None) -> dict:
+    delta = {"content": content} if finish_reason is None else {}
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+
+
+def gemini_response(text: str, prompt: str) -> dict:
+    prompt_tokens, completion_tokens = usage(prompt, text)
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": completion_tokens,
+                          "totalTokenCount": prompt_tokens + completion_tokens}
+    }
+
+
+def gemini_prompt(body: dict) -> str:
+    parts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                parts.append(part["text"])
+    return "\n".join(parts)
+
+
+def make_handler(config: LLMConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: dict):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, events):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            time.sleep(config.sample(config.ttft_ms))
+            for i, event in enumerate(events):
+                if i:
+                    time.sleep(config.token_ms / 1000)
+                payload = event if isinstance(event, str) else json.dumps(event, ensure_ascii=False)
+                self.wfile.write(f"data: {payload}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == CONTROL_PATH:
+                params = dict(part.split("=", 1) for part in url.query.split("&") if "=" in part)
+                config.update(params)
+                return self._send(200, config.as_dict())
+            self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self._read_json()
+            streaming = body.get("stream") or "streamGenerateContent" in url.path
+
+            if not streaming:
+                time.sleep(config.delay())
+            if config.should_fail():
+                return self._send(503, {"error": {"code": 503, "message": "injected failure", "status": "UNAVAILABLE"}})
+
+            if url.path.endswith("/chat/completions"):
+                return self._chat(body, streaming)
+            if ":generateContent" in url.path or ":streamGenerateContent" in url.path:
+                return self._gemini(body, streaming)
+            self._send(404, {"error": {"message": f"unknown endpoint {url.path}"}})
+
+        def _chat(self, body: dict, streaming: bool):
+            prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+            json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+            model = body.get("model", "fake")
+            text = canned_reply(prompt, json_mode)
+            if not streaming:
+                return self._send(200, openai_completion(model, text, prompt))
+
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            events = [openai_chunk(completion_id, model, part) for part in chunks(text, config.chunk_chars)]
+            events.append(openai_chunk(completion_id, model, "", finish_reason="stop"))
+            events.append("[DONE]")
+            self._stream(events)
+
+        def _gemini(self, body: dict, streaming: bool):
+            prompt = gemini_prompt(body)
+            json_mode = (body.get("generationConfig") or {}).get("responseMimeType") == "application/json"
+            text = canned_reply(prompt, json_mode)
+            if not streaming:
+                return self._send(200, gemini_response(text, prompt))
+            self._stream([gemini_response(part, prompt) for part in chunks(text, config.chunk_chars)])
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def llm_config(args) -> LLMConfig:
+    return LLMConfig(args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms, args.error_rate,
+                     distribution=args.distribution, seed=args.seed, ttft_ms=args.ttft_ms, token_ms=args.token_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokalny serwer udający API Groq/OpenAI (chat completions) i Gemini (generateContent) z gotowymi odpowiedziami.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8098)
+    add_fault_args(parser, latency_ms=400.0)
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="Mediana czasu do pierwszego fragmentu odpowiedzi strumieniowej")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="Opóźnienie między fragmentami odpowiedzi strumieniowej")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(llm_config(args)))
+    base = f"http://{args.host}:{args.port}"
+    print(f"Fake LLM: {base} (zmiana parametrów: {CONTROL_PATH}?latency_ms=...&ttft_ms=...)")
+    print(f"Uruchom API z GROQ_BASE_URL={base} GEMINI_BASE_URL={base} (dowolne GROQ_API_KEY/GEMINI_API_KEY)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
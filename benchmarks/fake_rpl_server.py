@@ -0,0 +1,154 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SEARCH_PATH = "/api/rpl/medicinal-products/search/public"
+CONTROL_PATH = "/_control"
+DISTRIBUTIONS = ["fixed", "uniform", "lognormal", "exponential"]
+FAULT_FIELDS = ["latency_ms", "jitter_ms", "slow_rate", "slow_ms", "error_rate"]
+
+PRODUCTS = [
+    {"medicinalProductName": "Apap", "commonName": "Paracetamolum", "medicinalProductPower": "500 mg", "pharmaceuticalFormName": "Tabletki powlekane", "atcCode": "N02BE01"},
+    {"medicinalProductName": "Ibuprom", "commonName": "Ibuprofenum", "medicinalProductPower": "200 mg", "pharmaceuticalFormName": "Tabletki drażowane", "atcCode": "M01AE01"},
+    {"medicinalProductName": "Polopiryna S", "commonName": "Acidum acetylsalicylicum", "medicinalProductPower": "300 mg", "pharmaceuticalFormName": "Tabletki", "atcCode": "N02BA01"},
+    {"medicinalProductName": "Tramal", "commonName": "Tramadoli hydrochloridum", "medicinalProductPower": "50 mg", "pharmaceuticalFormName": "Kapsułki twarde", "atcCode": "N02AX02"},
+    {"medicinalProductName": "Doreta", "commonName": "Tramadoli hydrochloridum + Paracetamolum", "medicinalProductPower": "37,5 mg + 325 mg", "pharmaceuticalFormName": "Tabletki powlekane", "atcCode": "N02AJ13"},
+    {"medicinalProductName": "Xanax", "commonName": "Alprazolamum", "medicinalProductPower": "0,5 mg", "pharmaceuticalFormName": "Tabletki", "atcCode": "N05BA12"},
+    {"medicinalProductName": "Warfin", "commonName": "Warfarinum natricum", "medicinalProductPower": "5 mg", "pharmaceuticalFormName": "Tabletki", "atcCode": "B01AA03"},
+]
+
+
+class FaultConfig:
+    def __init__(self, latency_ms: float, jitter_ms: float, slow_rate: float, slow_ms: float, error_rate: float,
+                 distribution: str = "uniform", seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.distribution = distribution
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def update(self, values: dict):
+        with self.lock:
+            for name in FAULT_FIELDS:
+                if name in values:
+                    setattr(self, name, float(values[name]))
+            if values.get("distribution") in DISTRIBUTIONS:
+                self.distribution = values["distribution"]
+
+    def as_dict(self) -> dict:
+        return {"distribution": self.distribution, **{name: getattr(self, name) for name in FAULT_FIELDS}}
+
+    def sample(self, median_ms: float) -> float:
+        with self.lock:
+            if self.distribution == "fixed" or median_ms <= 0:
+                delay = median_ms
+            elif self.distribution == "lognormal":
+                sigma = self.jitter_ms / median_ms if self.jitter_ms else 0.5
+                delay = self.random.lognormvariate(math.log(median_ms), sigma)
+            elif self.distribution == "exponential":
+                delay = self.random.expovariate(1 / median_ms)
+            else:
+                delay = median_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+            if self.random.random() < self.slow_rate:
+                delay = self.slow_ms
+        return max(0.0, delay) / 1000
+
+    def delay(self) -> float:
+        return self.sample(self.latency_ms)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+
+def search(params: dict) -> list:
+    term = (params.get("name") or params.get("commonName") or [""])[0].lower()
+    field = "medicinalProductName" if "name" in params else "commonName"
+    if not term:
+        return []
+    found = [p for p in PRODUCTS if term in p[field].lower()]
+    if not found and field == "medicinalProductName":
+        found = [{"medicinalProductName": term.capitalize(), "commonName": term, "medicinalProductPower": "10 mg",
+                  "pharmaceuticalFormName": "Tabletki", "atcCode": ""}]
+    return found
+
+
+def make_handler(config: FaultConfig):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: dict):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            if url.path == CONTROL_PATH:
+                config.update({k: v[0] for k, v in params.items()})
+                return self._send(200, config.as_dict())
+            if url.path != SEARCH_PATH:
+                return self._send(404, {"error": "not found"})
+
+            time.sleep(config.delay())
+            if config.should_fail():
+                return self._send(503, {"error": "injected failure"})
+            self._send(200, {"content": search(params)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def add_fault_args(parser: argparse.ArgumentParser, latency_ms: float):
+    parser.add_argument("--latency-ms", type=float, default=latency_ms, help="Mediana opóźnienia odpowiedzi")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="Rozrzut (uniform) lub odchylenie (lognormal)")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="uniform")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Odsetek odpowiedzi z opóźnieniem --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=8000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Odsetek odpowiedzi 503")
+    parser.add_argument("--seed", type=int, help="Ziarno generatora dla powtarzalnych opóźnień")
+
+
+def fault_config(args) -> FaultConfig:
+    return FaultConfig(args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms, args.error_rate,
+                       distribution=args.distribution, seed=args.seed)
+
+
+def start_server(handler, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"fake-server-{server.server_port}", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokalny serwer udający API Rejestru Produktów Leczniczych z wstrzykiwanym opóźnieniem i błędami.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_fault_args(parser, latency_ms=50.0)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fault_config(args)))
+    print(f"Fake RPL: http://{args.host}:{args.port}{SEARCH_PATH} (zmiana parametrów: {CONTROL_PATH}?latency_ms=...&error_rate=...)")
+    print(f"Uruchom API z RPL_API_URL=http://{args.host}:{args.port}{SEARCH_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
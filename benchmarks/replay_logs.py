@@ -0,0 +1,219 @@
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from guards import SecurityGuard
+
+LOG_PATTERN = os.path.join(ROOT, "logs_aggregate*.csv")
+EXPORT_FIELDS = ["offset_s", "query", "mode", "detected_drugs"]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+METRIC_LINE = re.compile(r'^knowyourpill_cache_requests_total\{cache="([^"]*)",result="([^"]*)"\} (\S+)$')
+LONG_NUMBER = re.compile(r"\d{5,}")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def read_log_rows(paths):
+    rows = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if row.get("query"):
+                    rows.append(row)
+    return rows
+
+
+def spread_offsets(rows):
+    if not rows:
+        return []
+    if "offset_s" in rows[0]:
+        return sorted(({**row, "offset_s": float(row["offset_s"])} for row in rows), key=lambda r: r["offset_s"])
+
+    rows = sorted(rows, key=lambda r: r["timestamp"])
+    start = datetime.strptime(rows[0]["timestamp"], TIMESTAMP_FORMAT)
+    per_second = Counter(row["timestamp"] for row in rows)
+    seen = Counter()
+    result = []
+    for row in rows:
+        second = (datetime.strptime(row["timestamp"], TIMESTAMP_FORMAT) - start).total_seconds()
+        offset = second + seen[row["timestamp"]] / per_second[row["timestamp"]]
+        seen[row["timestamp"]] += 1
+        result.append({**row, "offset_s": round(offset, 3)})
+    return result
+
+
+def anonymize(query: str) -> str:
+    return LONG_NUMBER.sub("00000", SecurityGuard.sanitize_input(query))
+
+
+def export(args):
+    paths = args.logs or sorted(glob.glob(LOG_PATTERN))
+    rows = spread_offsets(read_log_rows(paths))
+    with open(args.output, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({
+                "offset_s": row["offset_s"],
+                "query": anonymize(row["query"]),
+                "mode": row["mode"],
+                "detected_drugs": row.get("detected_drugs", "")
+            })
+    print(f"Wyeksportowano {len(rows)} zapytań z {len(paths)} plików do {args.output}")
+
+
+def cache_counters(base_url: str) -> dict:
+    try:
+        text = requests.get(f"{base_url}/metrics", timeout=5).text
+    except requests.RequestException:
+        return {}
+    counters = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            counters[(match.group(1), match.group(2))] = float(match.group(3))
+    return counters
+
+
+def cache_hit_rates(before: dict, after: dict) -> dict:
+    rates = {}
+    for cache in sorted({cache for cache, _ in after}):
+        hits = after.get((cache, "hit"), 0) - before.get((cache, "hit"), 0)
+        misses = after.get((cache, "miss"), 0) - before.get((cache, "miss"), 0)
+        if hits + misses:
+            rates[cache] = {"hits": int(hits), "misses": int(misses), "hit_rate": round(hits / (hits + misses), 4)}
+    return rates
+
+
+def drug_skew(rows, top: int) -> dict:
+    drugs = Counter()
+    for row in rows:
+        for drug in (row.get("detected_drugs") or "").split(","):
+            drug = drug.strip().lower()
+            if drug and drug != "none":
+                drugs[drug] += 1
+    total = sum(drugs.values())
+    top_count = sum(count for _, count in drugs.most_common(top))
+    return {"distinct": len(drugs), f"top{top}_share": round(top_count / total, 4) if total else 0.0,
+            "top": drugs.most_common(top)}
+
+
+def replay(args):
+    paths = args.logs or sorted(glob.glob(LOG_PATTERN))
+    rows = spread_offsets(read_log_rows(paths))
+    if args.limit:
+        rows = rows[:args.limit]
+    if not rows:
+        print("Brak zapytań do odtworzenia.")
+        return 1
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    results = []
+    lock = threading.Lock()
+
+    def send(row, scheduled):
+        lag = time.perf_counter() - scheduled
+        payload = {"query": row["query"], "mode": args.mode or row["mode"] or "groq"}
+        started = time.perf_counter()
+        try:
+            status = session.post(f"{args.url}/ask", json=payload, timeout=args.timeout).status_code
+        except requests.RequestException:
+            status = 0
+        with lock:
+            results.append({"status": status, "latency_ms": (time.perf_counter() - started) * 1000, "lag_ms": lag * 1000})
+
+    before = cache_counters(args.url)
+    duration = rows[-1]["offset_s"] / args.speedup
+    print(f"Odtwarzanie {len(rows)} zapytań z {len(paths)} plików, x{args.speedup} (~{duration:.0f}s)...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        for row in rows:
+            scheduled = started + row["offset_s"] / args.speedup
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, row, scheduled)
+    elapsed = time.perf_counter() - started
+    after = cache_counters(args.url)
+
+    ok = [r for r in results if 200 <= r["status"] < 300]
+    latencies = [r["latency_ms"] for r in results]
+    report = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4),
+        "throughput_rps": round(len(results) / elapsed, 2),
+        "latency_ms": {f"p{int(q * 100)}": round(percentile(latencies, q), 1) for q in [0.5, 0.95, 0.99]},
+        "schedule_lag_ms_p95": round(percentile([r["lag_ms"] for r in results], 0.95), 1),
+        "cache_hit_rates": cache_hit_rates(before, after),
+        "drug_skew": drug_skew(rows, args.top)
+    }
+
+    print(f"Zapytania: {report['requests']}, błędy: {report['error_rate']*100:.1f}%, {report['throughput_rps']} zapytań/s")
+    print("Opóźnienia: " + ", ".join(f"{k} {v:.0f} ms" for k, v in report["latency_ms"].items()))
+    print(f"Opóźnienie względem harmonogramu (p95): {report['schedule_lag_ms_p95']:.0f} ms")
+    if report["cache_hit_rates"]:
+        print("Trafienia w cache:")
+        for cache, r in report["cache_hit_rates"].items():
+            print(f"- {cache}: {r['hit_rate']*100:.1f}% ({r['hits']}/{r['hits'] + r['misses']})")
+    else:
+        print("Brak danych o cache (/metrics niedostępne).")
+    skew = report["drug_skew"]
+    print(f"Leki: {skew['distinct']} różnych, top {args.top} to {skew[f'top{args.top}_share']*100:.1f}% wystąpień")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k != "func"}, "results": report}, f,
+                      indent=2, ensure_ascii=False)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Odtwarzanie ruchu z logs_aggregate.csv z zachowaniem odstępów między zapytaniami.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Zanonimizowany eksport logów z względnymi czasami")
+    export_parser.add_argument("logs", nargs="*", help="Pliki CSV (domyślnie logs_aggregate*.csv)")
+    export_parser.add_argument("--output", default="replay_export.csv")
+    export_parser.set_defaults(func=export)
+
+    run_parser = commands.add_parser("run", help="Odtwórz ruch na działającym API")
+    run_parser.add_argument("logs", nargs="*", help="Logi lub eksport (domyślnie logs_aggregate*.csv)")
+    run_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--speedup", type=float, default=1.0, help="Przyspieszenie ruchu względem oryginału")
+    run_parser.add_argument("--mode", help="Wymuś tryb zamiast trybu z logu (np. local)")
+    run_parser.add_argument("--limit", type=int)
+    run_parser.add_argument("--max-workers", type=int, default=32)
+    run_parser.add_argument("--timeout", type=float, default=60)
+    run_parser.add_argument("--top", type=int, default=10)
+    run_parser.add_argument("--output", help="Zapisz wyniki do pliku JSON")
+    run_parser.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger("cache")
+
+cache_requests = metrics.counter(
+    "knowyourpill_cache_requests_total",
+    "Odczyty z pamięci podręcznych według wyniku (hit/miss)",
+    ("cache", "result")
+)
+
+
+class TTLCache:
+    def __init__(self, max_size: int = 1000, ttl: float = 3600.0, path: Optional[str] = None, save_interval: float = 5.0,
+                 name: Optional[str] = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.time()
+        self.hits = 0
+        self.misses = 0
+
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] < time.time():
+                del self._data[key]
+                item = None
+
+            if item is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+
+        if self.name:
+            cache_requests.inc(cache=self.name, result="miss" if item is None else "hit")
+        return default if item is None else item[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + (ttl if ttl is not None else self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            self._dirty = True
+
+        if self.path and time.time() - self._last_save >= self.save_interval:
+            self.save()
+
+    def items(self):
+        now = time.time()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._data.items() if expires_at >= now]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[1] >= time.time()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._dirty = True
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except Exception as e:
+            logger.error(f"Błąd odczytu pamięci podręcznej {self.path}: {e}")
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, value, expires_at in records[-self.max_size:]:
+                if expires_at >= now:
+                    self._data[key] = (value, expires_at)
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+
+        with self._lock:
+            now = time.time()
+            records = [[key, value, expires_at] for key, (value, expires_at) in self._data.items() if expires_at >= now]
+            self._dirty = False
+            self._last_save = now
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(records, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Błąd zapisu pamięci podręcznej {self.path}: {e}")
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Tuple
+
+from knowledge import normalize
+
+logger = logging.getLogger("context")
+
+TOKENIZERS = {
+    "groq": os.getenv("GROQ_TOKENIZER", "unsloth/Llama-3.3-70B-Instruct"),
+    "gemini": os.getenv("GEMINI_TOKENIZER_MODEL", "gemini-2.0-flash"),
+}
+TOKEN_BUDGETS = {
+    "groq": int(os.getenv("CONTEXT_TOKEN_BUDGET_GROQ", "1500")),
+    "gemini": int(os.getenv("CONTEXT_TOKEN_BUDGET_GEMINI", "3000")),
+}
+DEFAULT_TOKEN_BUDGET = 1500
+APPROX_CHARS_PER_TOKEN = 3
+REGISTRY_PREFIX = "Dane z Rejestru: "
+
+
+class TokenCounter:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self._count = None
+        self.exact = False
+        self._lock = threading.Lock()
+
+    def _exact_counter(self, name: str, download: bool):
+        if self.mode == "groq":
+            from tokenizers import Tokenizer
+            if os.path.isfile(name):
+                path = name
+            else:
+                from huggingface_hub import hf_hub_download
+                path = hf_hub_download(name, "tokenizer.json", local_files_only=not download)
+            tokenizer = Tokenizer.from_file(path)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        if self.mode == "gemini" and download:
+            from google.genai.local_tokenizer import LocalTokenizer
+            tokenizer = LocalTokenizer(model_name=name)
+            return lambda text: tokenizer.count_tokens(text).total_tokens
+        return None
+
+    def load(self, download: bool = False):
+        with self._lock:
+            if self.exact or (self._count is not None and not download):
+                return
+            name = TOKENIZERS.get(self.mode)
+            reason = "tokenizer pobierany tylko przy rozgrzewce (WARMUP=1)"
+            count = None
+            if name:
+                try:
+                    count = self._exact_counter(name, download)
+                except Exception as e:
+                    reason = str(e)
+
+            if count is not None:
+                self._count = count
+                self.exact = True
+            elif self._count is None:
+                if name:
+                    logger.warning(f"Brak tokenizera dla {self.mode} ({name}), używam przybliżenia: {reason}")
+                self._count = lambda text: (len(text) + APPROX_CHARS_PER_TOKEN - 1) // APPROX_CHARS_PER_TOKEN
+
+    def count(self, text: str) -> int:
+        if self._count is None:
+            self.load()
+        if not text:
+            return 0
+        return self._count(text)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        tokens = self.count(text)
+        while tokens > max_tokens and text:
+            text = text[:max(1, int(len(text) * max_tokens / tokens) - 1)]
+            tokens = self.count(text)
+        return text
+
+
+class ContextPacker:
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def counter(self, mode: str) -> TokenCounter:
+        with self._lock:
+            if mode not in self._counters:
+                self._counters[mode] = TokenCounter(mode)
+            return self._counters[mode]
+
+    def count(self, text: str, mode: str) -> int:
+        return self.counter(mode).count(text)
+
+    @staticmethod
+    def registry_facts(tool_result: str) -> List[str]:
+        facts = []
+        for line in tool_result.split("\n"):
+            if REGISTRY_PREFIX in line:
+                try:
+                    data = json.loads(line.split(REGISTRY_PREFIX, 1)[1])
+                    facts.extend(str(v) for v in data.values() if v)
+                    continue
+                except:
+                    pass
+            if line.strip():
+                facts.append(line)
+        return [normalize(f) for f in facts]
+
+    @staticmethod
+    def _record_key(text: str) -> str:
+        return " ".join(re.findall(r"\w+", normalize(text)))
+
+    def rank(self, query: str, records: List[dict], tool_result: str) -> Tuple[List[dict], int]:
+        facts = self.registry_facts(tool_result)
+        fact_text = " ".join(self._record_key(f) for f in facts)
+        query_terms = {w for w in re.findall(r"\w+", normalize(query + " " + fact_text)) if len(w) > 3}
+
+        seen = set()
+        ranked = []
+        duplicates = 0
+        for position, record in enumerate(records):
+            key = self._record_key(record["text"])
+            value = self._record_key(record["text"].split(":", 1)[-1])
+            if not key or key in seen or (value and f" {value} " in f" {fact_text} "):
+                duplicates += 1
+                continue
+            seen.add(key)
+
+            overlap = len(query_terms & set(key.split()))
+            ranked.append((overlap, record.get("score", 0.0), -position, record))
+
+        ranked.sort(key=lambda r: r[:3], reverse=True)
+        return [r[3] for r in ranked], duplicates
+
+    def pack(self, query: str, records: List[dict], tool_result: str, mode: str) -> Tuple[str, Dict]:
+        counter = self.counter(mode)
+        budget = TOKEN_BUDGETS.get(mode, DEFAULT_TOKEN_BUDGET)
+
+        info = f"\nInfo: {tool_result}"
+        info_tokens = counter.count(info)
+        if info_tokens > budget:
+            info = counter.truncate(info, budget)
+            info_tokens = counter.count(info)
+
+        remaining = budget - info_tokens
+        ranked, duplicates = self.rank(query, records, tool_result)
+        selected = []
+        for record in ranked:
+            line = f"[Źródło ID:{record['id']}] {record['text']}"
+            line_tokens = counter.count(line + "\n")
+            if line_tokens > remaining:
+                continue
+            selected.append((record["id"], line))
+            remaining -= line_tokens
+
+        rag_context = "\n".join(line for _, line in sorted(selected))
+        context = f"{rag_context}{info}"
+        stats = {
+            "budget": budget,
+            "context_tokens": budget - remaining,
+            "records_total": len(records),
+            "records_used": len(selected),
+            "records_duplicate": duplicates,
+            "exact_tokens": counter.exact
+        }
+        return context, stats
+
+
+context_packer = ContextPacker()
@@ -0,0 +1,83 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE_MS", "30000")) / 1000
+
+_current = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget: float, parent: Optional["Deadline"] = None):
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+        self.cut_short: List[str] = parent.cut_short if parent is not None else []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Przekroczono czas na obsługę zapytania.")
+        return min(cap, remaining)
+
+    def mark(self, stage: str):
+        if stage not in self.cut_short:
+            self.cut_short.append(stage)
+
+    def child(self, budget: float) -> "Deadline":
+        return Deadline(budget, parent=self)
+
+    @contextmanager
+    def scope(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+def get_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def remaining_timeout(cap: float) -> float:
+    deadline = _current.get()
+    return cap if deadline is None else deadline.timeout(cap)
+
+
+def stage_allowed(stage: str, min_remaining: float = 0.0) -> bool:
+    deadline = _current.get()
+    if deadline is None or deadline.remaining() > min_remaining:
+        return True
+    deadline.mark(stage)
+    return False
+
+
+def mark_if_expired(stage: str) -> bool:
+    deadline = _current.get()
+    if deadline is not None and deadline.expired():
+        deadline.mark(stage)
+        return True
+    return False
+
+
+@contextmanager
+def use_deadline(deadline: Optional[Deadline]):
+    if deadline is None:
+        yield None
+        return
+    with deadline.scope():
+        yield deadline
@@ -0,0 +1,190 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("drug_store")
+
+DRUG_DB_FILE = os.getenv("DRUG_DB_FILE", "my_drugs.db")
+DRUG_IMAGE_DIR = os.getenv("DRUG_IMAGE_DIR", "drug_images")
+LEGACY_FILE = "my_drugs.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drugs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    dose TEXT NOT NULL DEFAULT '',
+    days TEXT NOT NULL DEFAULT '[]',
+    times TEXT NOT NULL DEFAULT '[]',
+    gov_info TEXT,
+    image_url TEXT,
+    image_hash TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+COLUMNS = ["name", "dose", "days", "times", "gov_info", "image_url", "image_hash"]
+JSON_COLUMNS = {"days", "times"}
+
+
+class DrugStore:
+    def __init__(self, path: str = DRUG_DB_FILE, image_dir: str = DRUG_IMAGE_DIR, legacy_file: Optional[str] = LEGACY_FILE):
+        self.path = path
+        self.image_dir = image_dir
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        if legacy_file and os.path.exists(legacy_file):
+            self.migrate(legacy_file)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _row(self, row: sqlite3.Row) -> Dict:
+        drug = dict(row)
+        for column in JSON_COLUMNS:
+            drug[column] = json.loads(drug[column] or "[]")
+        return drug
+
+    def _values(self, fields: Dict) -> Dict:
+        return {k: json.dumps(v, ensure_ascii=False) if k in JSON_COLUMNS else v for k, v in fields.items() if k in COLUMNS}
+
+    def list(self) -> List[Dict]:
+        with self._connect() as conn:
+            return [self._row(row) for row in conn.execute("SELECT * FROM drugs ORDER BY id")]
+
+    def get(self, drug_id: int) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM drugs WHERE id = ?", (drug_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def _insert(self, conn: sqlite3.Connection, drug: Dict) -> int:
+        values = self._values(drug)
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        return conn.execute(f"INSERT INTO drugs ({columns}) VALUES ({placeholders})", list(values.values())).lastrowid
+
+    def add(self, drug: Dict) -> Dict:
+        with self._connect() as conn:
+            drug_id = self._insert(conn, drug)
+        return self.get(drug_id)
+
+    def update(self, drug_id: int, **fields) -> Optional[Dict]:
+        values = self._values(fields)
+        if values:
+            assignments = ", ".join(f"{column} = ?" for column in values)
+            with self._connect() as conn:
+                conn.execute(f"UPDATE drugs SET {assignments} WHERE id = ?", [*values.values(), drug_id])
+        return self.get(drug_id)
+
+    def delete(self, drug_id: int):
+        drug = self.get(drug_id)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM drugs WHERE id = ?", (drug_id,))
+        if drug and drug["image_hash"]:
+            self._release_image(drug["image_hash"])
+
+    def image_path(self, image_hash: str) -> str:
+        return os.path.join(self.image_dir, image_hash[:2], f"{image_hash}.png")
+
+    def load_image(self, image_hash: str) -> Optional[bytes]:
+        try:
+            with open(self.image_path(image_hash), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def image_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _store_image(self, data: bytes) -> str:
+        image_hash = self.image_hash(data)
+        path = self.image_path(image_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return image_hash
+
+    def _release_image(self, image_hash: str):
+        with self._lock:
+            with self._connect() as conn:
+                in_use = conn.execute("SELECT 1 FROM drugs WHERE image_hash = ? LIMIT 1", (image_hash,)).fetchone()
+            if not in_use:
+                try:
+                    os.remove(self.image_path(image_hash))
+                except FileNotFoundError:
+                    pass
+
+    def set_image(self, drug_id: int, data: Optional[bytes]) -> Optional[Dict]:
+        previous = self.get(drug_id)
+        image_hash = self._store_image(data) if data else None
+        drug = self.update(drug_id, image_hash=image_hash)
+        if previous and previous["image_hash"] and previous["image_hash"] != image_hash:
+            self._release_image(previous["image_hash"])
+        return drug
+
+    def migrate(self, legacy_file: str):
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_migrated'").fetchone():
+                return
+
+        try:
+            with open(legacy_file, "r", encoding="utf-8") as f:
+                drugs = json.load(f)
+        except Exception as e:
+            logger.error(f"Błąd odczytu {legacy_file} podczas migracji: {e}")
+            return
+
+        rows = []
+        images = []
+        for drug in drugs:
+            custom_image = drug.get("custom_image")
+            image = None
+            if custom_image and "," in custom_image:
+                try:
+                    image = base64.b64decode(custom_image.split(",", 1)[1])
+                except ValueError:
+                    logger.warning(f"Pominięto uszkodzone zdjęcie leku {drug.get('name')}")
+            images.append(image)
+            rows.append({
+                "name": drug.get("name", ""),
+                "dose": drug.get("dose", ""),
+                "days": drug.get("days", []),
+                "times": drug.get("times") or [drug.get("time", "08:00")],
+                "gov_info": drug.get("gov_info"),
+                "image_url": drug.get("image_url")
+            })
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_migrated'").fetchone():
+                return
+            if rows and conn.execute("SELECT 1 FROM drugs LIMIT 1").fetchone():
+                logger.warning(f"Baza {self.path} zawiera już leki, pomijam {len(rows)} leków z {legacy_file}")
+                rows = []
+            for row, image in zip(rows, images):
+                row["image_hash"] = self._store_image(image) if image else None
+                self._insert(conn, row)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_migrated', ?)", (legacy_file,))
+        if rows:
+            logger.info(f"Przeniesiono {len(rows)} leków z {legacy_file} do {self.path}")
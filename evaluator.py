@@ -1,28 +1,37 @@
 import requests
+import argparse
+import itertools
 import json
+import math
+import sys
+import threading
 import time
 import csv
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 API_URL = "http://127.0.0.1:8000/ask"
 TEST_CASES_FILE = "test_cases.json"
 REPORT_FILE = "evaluation_report.csv"
+LOAD_REPORT_FILE = "load_report.csv"
+LOAD_FIELDS = ["type", "requests", "errors", "error_rate", "throughput_rps", "avg_ms", "p50_ms", "p95_ms", "p99_ms"]
 
 def estimate_tokens(text):
 
     return len(text) // 4
 
-def run_test(case):
+def run_test(case, session=requests, timeout=30):
     payload = {
         "query": case["query"],
         "mode": "groq",
         "use_functions": True,
-        "json_mode": case.get("json_mode", False)
+        "json_mode": case.get("json_mode", False),
+        "trace": True
     }
     
     start_time = time.time()
     try:
-        response = requests.post(API_URL, json=payload, timeout=30)
+        response = session.post(API_URL, json=payload, timeout=timeout)
         latency = time.time() - start_time
         status_code = response.status_code
         data = response.json() if status_code == 200 else {"error": response.text}
@@ -30,6 +39,7 @@ def run_test(case):
         latency = time.time() - start_time
         return {
             "id": case["id"],
+            "type": case["type"],
             "success": False,
             "latency": latency,
             "error": str(e),
@@ -47,11 +57,18 @@ def run_test(case):
         "json_valid": False,
         "injection_blocked": False,
         "rag_ok": False,
-        "comment": ""
+        "comment": "",
+        "timings": data.get("timings") or {} if status_code == 200 else {}
     }
 
 
-    if case["type"] in ["injection", "path_traversal"]:
+    attack = case["type"] in ["injection", "path_traversal"]
+    if not attack and not 200 <= status_code < 300:
+        results["success"] = False
+        results["comment"] = f"BŁĄD: Nieoczekiwany status {status_code}."
+
+
+    if attack:
         if status_code == case.get("expected_status", 400):
             results["injection_blocked"] = True
             results["comment"] = "Poprawnie zablokowano atak."
@@ -102,20 +119,179 @@ def run_test(case):
 
     return results
 
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+def stage_summary(timings):
+    stages = {}
+    for case_timings in timings:
+        for stage, duration in case_timings.items():
+            stages.setdefault(stage, []).append(duration)
+    return {
+        stage: (sum(values) / len(values), percentile(values, 0.95), len(values))
+        for stage, values in sorted(stages.items(), key=lambda item: item[0] == "total")
+    }
+
+def load_worker(cases, stop, results, lock, timeout):
+    session = requests.Session()
+    while True:
+        with lock:
+            if stop():
+                return
+            case = next(cases)
+            results.append(None)
+            slot = len(results) - 1
+        res = run_test(case, session=session, timeout=timeout)
+        with lock:
+            results[slot] = res
+
+def run_load(test_cases, concurrency, duration=None, total_requests=None, timeout=30):
+    cases = itertools.cycle(test_cases)
+    results = []
+    lock = threading.Lock()
+    started = time.time()
+    if total_requests:
+        stop = lambda: len(results) >= total_requests
+    else:
+        stop = lambda: time.time() - started >= duration
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(load_worker, cases, stop, results, lock, timeout)
+    return [r for r in results if r is not None], time.time() - started
+
+def load_summary(results, elapsed):
+    groups = {}
+    for res in results:
+        groups.setdefault(res["type"], []).append(res)
+    groups["all"] = results
+
+    rows = []
+    for case_type, group in groups.items():
+        latencies = [r["latency"] * 1000 for r in group]
+        errors = sum(1 for r in group if not r["success"])
+        rows.append({
+            "type": case_type,
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": round(errors / len(group), 4),
+            "throughput_rps": round(len(group) / elapsed, 2),
+            "avg_ms": round(sum(latencies) / len(latencies), 1),
+            "p50_ms": round(percentile(latencies, 0.5), 1),
+            "p95_ms": round(percentile(latencies, 0.95), 1),
+            "p99_ms": round(percentile(latencies, 0.99), 1)
+        })
+    return rows
+
+def write_load_report(rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=LOAD_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def read_load_report(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return {row["type"]: row for row in csv.DictReader(f)}
+
+def compare_runs(baseline, current, threshold):
+    regressions = []
+    print(f"\nPorównanie z poprzednim przebiegiem (próg {threshold*100:.0f}%):")
+    for case_type, row in current.items():
+        old = baseline.get(case_type)
+        if old is None:
+            continue
+        for field in ["p50_ms", "p95_ms", "p99_ms"]:
+            before, after = float(old[field]), float(row[field])
+            change = (after - before) / before if before else 0.0
+            flag = change > threshold
+            print(f"- {case_type} {field}: {before:.1f} -> {after:.1f} ({change*100:+.1f}%){' REGRESJA' if flag else ''}")
+            if flag:
+                regressions.append(f"{case_type} {field}")
+        before, after = float(old["throughput_rps"]), float(row["throughput_rps"])
+        if before and (before - after) / before > threshold:
+            print(f"- {case_type} throughput: {before:.2f} -> {after:.2f} rps REGRESJA")
+            regressions.append(f"{case_type} throughput_rps")
+        before, after = float(old["error_rate"]), float(row["error_rate"])
+        if after - before > 0.01:
+            print(f"- {case_type} error rate: {before*100:.1f}% -> {after*100:.1f}% REGRESJA")
+            regressions.append(f"{case_type} error_rate")
+    return regressions
+
+def print_load_summary(rows):
+    print(f"{'Typ':<16}{'Zapytania':>10}{'Błędy':>8}{'RPS':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in rows:
+        print(f"{row['type']:<16}{row['requests']:>10}{row['error_rate']*100:>7.1f}%{row['throughput_rps']:>8.2f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+def load_main(args, test_cases):
+    if args.warmup:
+        print(f"Rozgrzewka: {args.warmup}s...")
+        run_load(test_cases, args.concurrency, duration=args.warmup, timeout=args.timeout)
+
+    target = f"{args.requests} zapytań" if args.requests else f"{args.duration}s"
+    print(f"Test obciążeniowy: {args.concurrency} równoległych klientów, {target}...")
+    results, elapsed = run_load(test_cases, args.concurrency, duration=args.duration,
+                                total_requests=args.requests, timeout=args.timeout)
+    if not results:
+        print("Brak wyników.")
+        return 1
+
+    rows = load_summary(results, elapsed)
+    write_load_report(rows, args.report)
+    print_load_summary(rows)
+    print(f"\nRaport zapisany w {args.report}")
+
+    if args.baseline:
+        regressions = compare_runs(read_load_report(args.baseline), {row["type"]: row for row in rows}, args.threshold)
+        if regressions:
+            print(f"Wykryto regresje: {', '.join(regressions)}")
+            return 1
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ewaluacja API KnowYourPill (testy jakości lub obciążeniowe).")
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--cases", default=TEST_CASES_FILE)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--load", action="store_true", help="Tryb obciążeniowy")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60, help="Czas testu w sekundach (gdy brak --requests)")
+    parser.add_argument("--requests", type=int, help="Łączna liczba zapytań zamiast --duration")
+    parser.add_argument("--warmup", type=float, default=5, help="Czas rozgrzewki w sekundach, wyniki są pomijane")
+    parser.add_argument("--report", default=LOAD_REPORT_FILE)
+    parser.add_argument("--baseline", help="Raport poprzedniego przebiegu do porównania")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Porównaj dwa zapisane raporty")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Dopuszczalny wzrost opóźnień (ułamek)")
+    return parser.parse_args()
+
 def main():
-    if not os.path.exists(TEST_CASES_FILE):
-        print(f"Błąd: Brak pliku {TEST_CASES_FILE}")
+    global API_URL
+    args = parse_args()
+    API_URL = args.url
+
+    if args.compare:
+        regressions = compare_runs(read_load_report(args.compare[0]), read_load_report(args.compare[1]), args.threshold)
+        return 1 if regressions else 0
+
+    if not os.path.exists(args.cases):
+        print(f"Błąd: Brak pliku {args.cases}")
         return
 
-    with open(TEST_CASES_FILE, "r", encoding="utf-8") as f:
+    with open(args.cases, "r", encoding="utf-8") as f:
         test_cases = json.load(f)
 
+    if args.load:
+        return load_main(args, test_cases)
+
     all_results = []
+    all_timings = []
     print(f"Uruchamiam {len(test_cases)} testów...")
 
     for case in test_cases:
         print(f"Test {case['id']} ({case['type']})... ", end="", flush=True)
-        res = run_test(case)
+        res = run_test(case, timeout=args.timeout)
+        all_timings.append(res.pop("timings", {}))
         all_results.append(res)
         print("OK" if res["success"] else "FAIL")
 
@@ -132,6 +308,7 @@ def main():
     
     rag_cases = [r for r in test_cases if r.get("type") == "rag"]
     avg_recall = (sum(r.get("recall", 0) for r in all_results if r.get("type") == "rag") / len(rag_cases)) if rag_cases else 0
+    stages = stage_summary(all_timings)
 
 
     keys = all_results[0].keys()
@@ -148,6 +325,12 @@ def main():
         f.write(f"Injection Block Rate,{injection_rate*100:.1f}%\n")
         f.write(f"Avg RAG Recall,{avg_recall*100:.1f}%\n")
 
+        if stages:
+            f.write("\nCZASY ETAPÓW\n")
+            f.write("Etap,Avg ms,P95 ms,Próbki\n")
+            for stage, (avg_ms, p95_ms, count) in stages.items():
+                f.write(f"{stage},{avg_ms:.1f},{p95_ms:.1f},{count}\n")
+
     print(f"\nRaport zapisany w {REPORT_FILE}")
     print(f"Podsumowanie:")
     print(f"- Success Rate: {success_count/total*100:.1f}%")
@@ -155,6 +338,10 @@ def main():
     print(f"- JSON Pass-rate: {json_pass_rate*100:.1f}%")
     print(f"- Injection Block Rate: {injection_rate*100:.1f}%")
     print(f"- Avg RAG Recall: {avg_recall*100:.1f}%")
+    if stages:
+        print("Czasy etapów (avg / p95):")
+        for stage, (avg_ms, p95_ms, count) in stages.items():
+            print(f"- {stage}: {avg_ms:.0f} ms / {p95_ms:.0f} ms ({count})")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
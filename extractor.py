@@ -0,0 +1,197 @@
+import os
+import re
+import threading
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from cache import TTLCache
+from knowledge import KnowledgeBase, knowledge_base, normalize, term_key
+
+STOPWORDS = {
+    "czy", "mogę", "moge", "brać", "brac", "jak", "jest", "razem", "podaj", "skład", "sklad", "leku", "leki", "lek",
+    "mieszać", "mieszac", "stosować", "stosowac", "łączyć", "laczyc", "używać", "uzywac", "interakcje", "interakcja",
+    "można", "mozna", "jakie", "są", "sa", "między", "miedzy", "lekami", "dawka", "dawki", "tabletka", "tabletki",
+    "występują", "wystepuja", "bezpieczne", "przyjmować", "przyjmowac", "popijać", "popijac", "połączyć", "polaczyc",
+    "mam", "biorę", "biore", "dzień", "dzien", "dziennie", "rano", "wieczorem", "oraz", "albo", "lub", "tego", "tym"
+}
+MIN_FUZZY_LENGTH = 5
+MIN_ALIAS_SIMILARITY = 0.75
+END = "$"
+SENTENCE_END = ".!?:"
+
+
+def deletions(word: str) -> Set[str]:
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def query_cache_key(clean_query: str) -> str:
+    return " ".join(re.findall(r"\w+", normalize(clean_query)))
+
+
+def heuristic_extract(clean_query: str) -> List[str]:
+    potential_drugs = []
+    words = clean_query.split()
+    for word in words:
+        clean_word = word.strip("?,.!")
+        if len(clean_word) < 3: continue
+
+        base_word = clean_word
+        for suffix in ["em", "u", "a"]:
+            if clean_word.endswith(suffix) and len(clean_word) > len(suffix) + 2:
+                base_word = clean_word[:-len(suffix)]
+                break
+
+        if base_word[0].isupper() or len(base_word) >= 5:
+            if base_word.lower() not in ["czy", "mogę", "brać", "jak", "jest", "razem", "podaj", "skład", "leku", "mieszać", "stosować", "łączyć", "używać"]:
+                potential_drugs.append(base_word)
+
+    return list(dict.fromkeys(potential_drugs))
+
+
+class DrugExtractor:
+    def __init__(self, knowledge: KnowledgeBase = knowledge_base, dictionary_file: Optional[str] = None, aliases: Optional[TTLCache] = None):
+        self.knowledge = knowledge
+        self.dictionary_file = dictionary_file
+        self.aliases = aliases
+        self._trie = {}
+        self._fuzzy = {}
+        self._built = False
+        self._lock = threading.Lock()
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._build()
+                    self._built = True
+
+    def _build(self):
+        self.knowledge._ensure_loaded()
+        for entry in self.knowledge.entries:
+            fields = entry["fields"]
+            if fields.get("Nazwa"):
+                self._add(fields["Nazwa"], fields["Nazwa"])
+            substances = fields.get("Substancja") or fields.get("Substancje") or ""
+            for substance in substances.split("+"):
+                if substance.strip():
+                    self._add(substance.strip(), substance.strip().capitalize())
+
+        if self.dictionary_file and os.path.exists(self.dictionary_file):
+            with open(self.dictionary_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._add(line.strip(), line.strip())
+
+        if self.aliases is not None:
+            for surface, canonical in self.aliases.items():
+                self._add(surface, canonical)
+
+    def _add(self, surface: str, canonical: str):
+        keys = [term_key(w) for w in re.findall(r"\w+", surface)]
+        if not keys or normalize(surface) in STOPWORDS:
+            return
+
+        node = self._trie
+        for key in keys:
+            node = node.setdefault(key, {})
+        node.setdefault(END, canonical)
+
+        if len(keys) == 1 and len(keys[0]) >= MIN_FUZZY_LENGTH:
+            for variant in deletions(keys[0]) | {keys[0]}:
+                self._fuzzy.setdefault(variant, set()).add(keys[0])
+
+    def add_terms(self, names: Iterable[str]):
+        self._ensure_built()
+        with self._lock:
+            for name in names:
+                self._add(name, name)
+
+    def learn_aliases(self, clean_query: str, names: Iterable[str]) -> Dict[str, str]:
+        learned = {}
+        words = [w for w in re.findall(r"\w+", clean_query) if normalize(w) not in STOPWORDS and not w.isdigit()]
+        for name in names:
+            name_key = term_key(name)
+            best_word, best_ratio = None, 0.0
+            for word in words:
+                word_key = term_key(word)
+                if not word_key or word_key[0] != name_key[:1]:
+                    continue
+                ratio = SequenceMatcher(None, word_key, name_key).ratio()
+                if ratio > best_ratio:
+                    best_word, best_ratio = word, ratio
+
+            if best_word and best_ratio >= MIN_ALIAS_SIMILARITY and " " not in name:
+                learned[normalize(best_word)] = name
+
+        if learned:
+            self._ensure_built()
+            with self._lock:
+                for surface, canonical in learned.items():
+                    self._add(surface, canonical)
+                    if self.aliases is not None:
+                        self.aliases.set(surface, canonical)
+        return learned
+
+    def _correct(self, key: str) -> Optional[str]:
+        if len(key) < MIN_FUZZY_LENGTH:
+            return None
+
+        candidates = set(self._fuzzy.get(key, ()))
+        for variant in deletions(key):
+            candidates |= self._fuzzy.get(variant, set())
+        candidates = {c for c in candidates if c[0] == key[0]}
+        if len(candidates) != 1:
+            return None
+        return candidates.pop()
+
+    def extract(self, text: str) -> List[str]:
+        return self.extract_with_leftovers(text)[0]
+
+    def extract_with_leftovers(self, text: str) -> Tuple[List[str], List[str]]:
+        self._ensure_built()
+        matches = list(re.finditer(r"\w+", text))
+        words = [m.group() for m in matches]
+        keys = [None if normalize(w) in STOPWORDS or w.isdigit() else term_key(w) for w in words]
+
+        found = []
+        leftovers = []
+        i = 0
+        while i < len(keys):
+            match = None
+            node = self._trie
+            j = i
+            while j < len(keys) and keys[j] is not None:
+                key = keys[j] if keys[j] in node else (self._correct(keys[j]) if node is self._trie else None)
+                if key is None or key not in node:
+                    break
+                node = node[key]
+                j += 1
+                if END in node:
+                    match = (j, node[END])
+
+            if match:
+                found.append(match[1])
+                i = match[0]
+            else:
+                preceding = text[:matches[i].start()].rstrip()
+                sentence_start = not preceding or preceding[-1] in SENTENCE_END
+                if keys[i] is not None and len(words[i]) >= 3 and words[i][0].isupper() and not sentence_start:
+                    leftovers.append(words[i])
+                i += 1
+
+        return list(dict.fromkeys(found)), list(dict.fromkeys(leftovers))
+
+
+extraction_cache = TTLCache(
+    max_size=int(os.getenv("EXTRACTION_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("EXTRACTION_CACHE_TTL", str(30 * 24 * 3600))),
+    path=os.getenv("EXTRACTION_CACHE_FILE", "extraction_cache.json"),
+    name="extraction"
+)
+alias_cache = TTLCache(
+    max_size=int(os.getenv("EXTRACTION_ALIAS_SIZE", "50000")),
+    ttl=float(os.getenv("EXTRACTION_ALIAS_TTL", str(365 * 24 * 3600))),
+    path=os.getenv("EXTRACTION_ALIAS_FILE", "extraction_aliases.json"),
+    name="alias"
+)
+drug_extractor = DrugExtractor(dictionary_file=os.getenv("DRUG_DICTIONARY_FILE"), aliases=alias_cache)
@@ -1,36 +1,54 @@
 import streamlit as st
 import requests
 import json
-import os
-import base64
 from io import BytesIO
 from PIL import Image
-from datetime import time
 
-API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+from api_client import ApiError, check_cabinet, lookup_drug, stream_ask
+from drug_store import DrugStore
 
 st.set_page_config(page_title="Know Your Pill", layout="wide")
 
-DB_FILE = "my_drugs.json"
+@st.cache_resource
+def get_store():
+    return DrugStore()
 
 
 def load_drugs():
-    if os.path.exists(DB_FILE):
-        try:
-            with open(DB_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            st.error(f"Błąd podczas ładowania bazy leków: {e}")
-            return []
-    return []
-
-
-def save_drugs(drugs):
     try:
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump(drugs, f, ensure_ascii=False, indent=4)
+        return get_store().list()
     except Exception as e:
-        st.error(f"Błąd podczas zapisywania bazy leków: {e}")
+        st.error(f"Błąd podczas ładowania bazy leków: {e}")
+        return []
+
+
+STAGE_LABELS = {
+    "extraction": "Rozpoznawanie leków...",
+    "registry": "Pobieranie danych z rejestru...",
+    "rag": "Przeszukiwanie bazy wiedzy...",
+}
+
+
+def cached_stream_ask(payload):
+    answers = st.session_state.setdefault("answers", {})
+    key = json.dumps(payload, sort_keys=True)
+    if key in answers:
+        yield from answers[key]
+        return
+
+    events = []
+    for event, data in stream_ask(payload):
+        events.append((event, data))
+        yield event, data
+    if events and events[-1][0] == "done" and all(event != "error" for event, _ in events):
+        answers[key] = events
+
+
+def strip_verdict(answer):
+    for prefix in ["INTERAKCJA:", "BEZPIECZNIE:"]:
+        if answer.startswith(prefix):
+            return answer.replace(prefix, "", 1).strip()
+    return answer
 
 
 st.markdown("""
@@ -74,37 +92,53 @@ with tab_asystent:
         if not query:
             st.warning("Wpisz pytanie.")
         else:
-            with st.spinner("Analiza..."):
-                try:
-                    payload = {
-                        "query": query,
-                        "mode": mode,
-                        "use_functions": use_tools
-                    }
-                    response = requests.post(f"{API_URL}/ask", json=payload)
-
-                    if response.status_code == 200:
-                        data = response.json()
-                        answer = data["answer"]
-                        
-                        if answer.startswith("INTERAKCJA:"):
-                            st.error("Znaleziono potencjalne interakcje!")
-                            st.write(answer.replace("INTERAKCJA:", "").strip())
-                        elif answer.startswith("BEZPIECZNIE:"):
-                            st.success("Nie znaleziono potencjalnych interakcji.")
-                            st.write(answer.replace("BEZPIECZNIE:", "").strip())
+            try:
+                payload = {
+                    "query": query,
+                    "mode": mode,
+                    "use_functions": use_tools
+                }
+                status = st.status("Analiza...")
+                verdict_box = st.empty()
+                answer_box = st.empty()
+                answer = ""
+                logs = []
+
+                for event, data in cached_stream_ask(payload):
+                    if event == "stage":
+                        status.update(label=STAGE_LABELS.get(data["stage"], "Analiza..."))
+                    elif event == "verdict":
+                        if data["verdict"] == "INTERAKCJA":
+                            verdict_box.error("Znaleziono potencjalne interakcje!")
                         else:
-                            st.info("Odpowiedź systemu:")
-                            st.write(answer)
-
-                        with st.expander("Szczegóły techniczne"):
-                            for log in data["logs"]:
-                                st.text(f"> {log}")
-                    else:
-                        st.error(f"Błąd API: {response.text}")
-
-                except requests.exceptions.ConnectionError:
-                    st.error("Nie można połączyć się z serwerem Backend. Uruchom 'uvicorn main:app'.")
+                            verdict_box.success("Nie znaleziono potencjalnych interakcji.")
+                    elif event == "token":
+                        answer += data["text"]
+                        answer_box.write(strip_verdict(answer))
+                    elif event == "error":
+                        st.error(f"Błąd API: {data['detail']}")
+                    elif event == "done":
+                        answer = data["answer"]
+                        logs = data["logs"]
+
+                if not answer:
+                    status.update(label="Analiza przerwana", state="error")
+                elif answer.startswith("INTERAKCJA:") or answer.startswith("BEZPIECZNIE:"):
+                    status.update(label="Analiza zakończona", state="complete")
+                    answer_box.write(strip_verdict(answer))
+                else:
+                    status.update(label="Analiza zakończona", state="complete")
+                    verdict_box.info("Odpowiedź systemu:")
+                    answer_box.write(answer)
+
+                with st.expander("Szczegóły techniczne"):
+                    for log in logs:
+                        st.text(f"> {log}")
+
+            except requests.exceptions.ConnectionError:
+                st.error("Nie można połączyć się z serwerem Backend. Uruchom 'uvicorn main:app'.")
+            except requests.RequestException:
+                st.error("Serwer Backend nie odpowiada lub przerwał odpowiedź. Spróbuj ponownie za chwilę.")
 
 with tab_apteczka:
     st.markdown("Zarządzaj swoimi lekami i sprawdzaj ich interakcje.")
@@ -143,58 +177,21 @@ with tab_apteczka:
 
                 with st.spinner(f"Pobieranie informacji o {drug_name}..."):
                     try:
-                        payload = {"query": f"Podaj skład leku {drug_name} dawka {dose}", "mode": mode, "use_functions": True}
-                        response = requests.post(f"{API_URL}/ask", json=payload)
-                        gov_info = "Brak danych z rejestru."
-                        official_name = drug_name
-                        official_power = dose
-
-                        if response.status_code == 200:
-                            data = response.json()
-                            logs = data.get("logs", [])
-                            for log in logs:
-                                if "Dane z rejestru dla" in log:
-                                    gov_info = log.split(": ", 1)[-1]
-                                    break
-                                elif "Dane z Rejestru:" in log or "Tool Result" in log or "Retry Tool Result" in log:
-                                    if "Result: " in log:
-                                        gov_info = log.split("Result: ")[-1]
-                                    elif "Tool Result" in log:
-                                        gov_info = log.split(": ", 1)[-1]
-                                    else:
-                                        gov_info = log
-                                    break
-                            
-
-                            if gov_info == "Brak danych z rejestru." and data.get("answer"):
-
-                                if "Podaj skład leku" in query:
-                                     gov_info = data["answer"]
-
-                        image_url = None
                         try:
-                            if "{" in gov_info:
-                                import json
-                                start_idx = gov_info.find('{')
-                                end_idx = gov_info.rfind('}')
-                                if start_idx != -1 and end_idx != -1:
-                                    json_str = gov_info[start_idx:end_idx+1]
-                                    gov_json = json.loads(json_str)
-                                    official_name = gov_json.get("name", drug_name)
-                                    official_power = gov_json.get("power", dose)
-                        except:
-                            pass
+                            registry_data = lookup_drug(drug_name, dose or None, mode)
+                            gov_info = "Dane z Rejestru: " + json.dumps(registry_data, ensure_ascii=False)
+                        except ApiError:
+                            gov_info = "Brak danych z rejestru."
+                        image_url = None
 
-                        st.session_state.my_drugs.append({
+                        st.session_state.my_drugs.append(get_store().add({
                             "name": drug_name,
                             "dose": dose,
                             "days": freq,
                             "times": times_list,
                             "gov_info": gov_info,
-                            "image_url": image_url,
-                            "custom_image": None
-                        })
-                        save_drugs(st.session_state.my_drugs)
+                            "image_url": image_url
+                        }))
                         st.success(f"Dodano {drug_name} do apteczki.")
                         st.rerun()
                     except Exception as e:
@@ -275,35 +272,34 @@ with tab_apteczka:
                         except:
                             pass
 
-                    if drug.get("custom_image"):
-                        try:
-                            st.image(drug["custom_image"], width='stretch')
-                            displayed_image = True
-                            if st.button("Usuń własne zdjęcie", key=f"del_img_{i}"):
-                                drug["custom_image"] = None
-                                save_drugs(st.session_state.my_drugs)
-                                st.rerun()
-                        except:
-                            st.error("Błąd ładowania zdjęcia.")
+                    if drug.get("image_hash"):
+                        displayed_image = True
+                        if st.toggle("Pokaż własne zdjęcie", key=f"show_img_{drug['id']}"):
+                            try:
+                                st.image(get_store().load_image(drug["image_hash"]), width='stretch')
+                            except:
+                                st.error("Błąd ładowania zdjęcia.")
+                        if st.button("Usuń własne zdjęcie", key=f"del_img_{drug['id']}"):
+                            drug.update(get_store().set_image(drug["id"], None))
+                            st.rerun()
 
                     if not displayed_image:
                         st.caption("Brak zdjęcia")
 
-                    uploaded_file = st.file_uploader("Wgraj własne zdjęcie", type=["jpg", "jpeg", "png"], key=f"upload_{i}")
+                    uploaded_file = st.file_uploader("Wgraj własne zdjęcie", type=["jpg", "jpeg", "png"], key=f"upload_{drug['id']}")
                     if uploaded_file is not None:
                         img = Image.open(uploaded_file)
                         img.thumbnail((400, 400))
                         buffered = BytesIO()
                         img.save(buffered, format="PNG")
-                        img_str = base64.b64encode(buffered.getvalue()).decode()
-                        drug["custom_image"] = f"data:image/png;base64,{img_str}"
-                        save_drugs(st.session_state.my_drugs)
-                        st.rerun()
+                        if DrugStore.image_hash(buffered.getvalue()) != drug.get("image_hash"):
+                            drug.update(get_store().set_image(drug["id"], buffered.getvalue()))
+                            st.rerun()
 
                     st.markdown("---")
-                    if st.button("Usuń lek z apteczki", key=f"del_{i}", type="primary"):
+                    if st.button("Usuń lek z apteczki", key=f"del_{drug['id']}", type="primary"):
+                        get_store().delete(drug["id"])
                         st.session_state.my_drugs.pop(i)
-                        save_drugs(st.session_state.my_drugs)
                         st.rerun()
 
         if st.button("Sprawdź interakcje w mojej apteczce"):
@@ -311,30 +307,29 @@ with tab_apteczka:
                 st.info("Dodaj co najmniej dwa leki, aby sprawdzić interakcje między nimi.")
             else:
                 names = [d["name"] for d in st.session_state.my_drugs]
-                query_all = f"Czy występują interakcje między lekami: {', '.join(names)}?"
 
                 with st.spinner("Analiza całej apteczki..."):
                     try:
-                        payload = {
-                            "query": query_all,
-                            "mode": mode,
-                            "use_functions": use_tools
-                        }
-                        response = requests.post(f"{API_URL}/ask", json=payload)
-                        if response.status_code == 200:
-                            data = response.json()
-                            answer = data["answer"]
-                            st.subheader("Analiza interakcji w apteczce")
-                            
-                            if answer.startswith("INTERAKCJA:"):
-                                st.error("Znaleziono potencjalne interakcje!")
-                                st.write(answer.replace("INTERAKCJA:", "").strip())
-                            elif answer.startswith("BEZPIECZNIE:"):
-                                st.success("Nie znaleziono potencjalnych interakcji.")
-                                st.write(answer.replace("BEZPIECZNIE:", "").strip())
-                            else:
-                                st.warning(answer)
+                        data = check_cabinet(names, mode)
+                        st.subheader("Analiza interakcji w apteczce")
+
+                        labels = {True: "Interakcja", False: "Bezpiecznie", None: "Brak danych"}
+                        st.table({
+                            drug: [labels[value] if i != j else "—" for j, value in enumerate(row)]
+                            for i, (drug, row) in enumerate(zip(data["drugs"], data["matrix"]))
+                        })
+
+                        interactions = [p for p in data["pairs"] if p["interakcja"]]
+                        if interactions:
+                            st.error("Znaleziono potencjalne interakcje!")
+                            for pair in interactions:
+                                summary = pair["summary"].replace("INTERAKCJA:", "").strip()
+                                st.write(f"**{pair['drug_a']} + {pair['drug_b']}:** {summary}")
+                        elif all(p["interakcja"] is False for p in data["pairs"]):
+                            st.success("Nie znaleziono potencjalnych interakcji.")
                         else:
-                            st.error("Błąd podczas sprawdzania interakcji.")
+                            st.warning("Nie znaleziono interakcji, ale dla części par brakuje danych.")
+                    except ApiError:
+                        st.error("Błąd podczas sprawdzania interakcji.")
                     except:
                         st.error("Błąd połączenia.")
@@ -1,4 +1,5 @@
 import re
+import ast
 import json
 from typing import Optional, Tuple
 from jsonschema import validate, ValidationError
@@ -28,6 +29,60 @@ ANSWER_JSON_SCHEMA = {
     "required": ["answer", "interakcja"]
 }
 
+CODE_FENCE_REGEX = r"```(?:json)?\s*(.*?)```"
+TRAILING_COMMA_REGEX = r",\s*([}\]])"
+VERDICT_PREFIXES = {"INTERAKCJA": True, "BEZPIECZNIE": False}
+
+
+def _extract_object(text: str) -> Optional[str]:
+    start = text.find("{")
+    if start == -1:
+        return None
+
+    depth = 0
+    quote = None
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:] + "}" * depth if depth > 0 else None
+
+
+def _parse_object(candidate: str) -> Optional[dict]:
+    candidate = re.sub(TRAILING_COMMA_REGEX, r"\1", candidate)
+    try:
+        data = json.loads(candidate, strict=False)
+    except json.JSONDecodeError:
+        python_like = re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", re.sub(r"\bnull\b", "None", candidate)))
+        try:
+            data = ast.literal_eval(python_like)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return None
+    return data if isinstance(data, dict) else None
+
+
+def _infer_verdict(answer: str) -> Optional[bool]:
+    head = answer.lstrip(" \n*#>\"'")
+    for prefix, verdict in VERDICT_PREFIXES.items():
+        if head.startswith(prefix + ":"):
+            return verdict
+    return None
+
+
 class SecurityGuard:
     @staticmethod
     def sanitize_input(text: str) -> str:
@@ -65,3 +120,46 @@ class SecurityGuard:
             return False, f"Błąd walidacji schematu: {e.message}"
         except Exception as e:
             return False, str(e)
+
+    @staticmethod
+    def repair_json(text: str) -> Optional[str]:
+        if not isinstance(text, str) or not text.strip():
+            return None
+
+        text = text.strip()
+        fenced = re.search(CODE_FENCE_REGEX, text, re.DOTALL)
+        if fenced:
+            text = fenced.group(1).strip()
+
+        data = None
+        candidate = _extract_object(text)
+        if candidate:
+            data = _parse_object(candidate)
+        if data is None:
+            verdict = _infer_verdict(text)
+            if verdict is None:
+                return None
+            data = {"answer": text, "interakcja": verdict}
+
+        answer = data.get("answer")
+        if not isinstance(answer, str):
+            for key in ["odpowiedz", "odpowiedź", "response", "text"]:
+                if isinstance(data.get(key), str):
+                    answer = data.pop(key)
+                    break
+        if not isinstance(answer, str):
+            return None
+        data["answer"] = answer
+
+        interakcja = data.get("interakcja")
+        if isinstance(interakcja, str):
+            interakcja = {"true": True, "tak": True, "false": False, "nie": False}.get(interakcja.strip().lower())
+        if not isinstance(interakcja, bool):
+            interakcja = _infer_verdict(answer)
+        if interakcja is None:
+            return None
+        data["interakcja"] = interakcja
+
+        repaired = json.dumps(data, ensure_ascii=False)
+        is_valid, _ = SecurityGuard.is_valid_json(repaired)
+        return repaired if is_valid else None
@@ -0,0 +1,142 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+POLISH_CHARS = str.maketrans("ąćęłńóśźż", "acelnoszz")
+INFLECTION_ENDINGS = ["ami", "ach", "owi", "iem", "ego", "emu", "ym", "om", "ow", "em", "ej", "ie", "y", "i", "u", "a", "e", "o"]
+MIN_STEM_LENGTH = 3
+SPELLING_VARIANTS = [("ch", "h"), ("ph", "f"), ("th", "t"), ("qu", "kw"), ("x", "ks"), ("w", "v"), ("y", "i"), ("c", "k")]
+SEVERITY_RANK = {"Niskie": 1, "Umiarkowane": 2, "Wysokie": 3}
+
+
+def normalize(text: str) -> str:
+    return text.lower().translate(POLISH_CHARS).strip()
+
+
+def stem(word: str) -> str:
+    word = normalize(word)
+    for ending in INFLECTION_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def term_key(word: str) -> str:
+    key = stem(word)
+    for variant, replacement in SPELLING_VARIANTS:
+        key = key.replace(variant, replacement)
+    return re.sub(r"(.)\1", r"\1", key)
+
+
+def phrase_key(text: str) -> Tuple[str, ...]:
+    return tuple(term_key(w) for w in re.findall(r"\w+", text))
+
+
+class KnowledgeBase:
+    def __init__(self, knowledge_file="knowledge.txt"):
+        self.knowledge_file = knowledge_file
+        self.entries = []
+        self.interactions = []
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                    self._loaded = True
+
+    def _load(self):
+        if not os.path.exists(self.knowledge_file):
+            return
+
+        with open(self.knowledge_file, "r", encoding="utf-8") as f:
+            blocks = f.read().split("\n\n")
+
+        for block in blocks:
+            fields = {}
+            for line in block.strip().split("\n"):
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    fields[key.strip()] = value.strip()
+            if not fields:
+                continue
+
+            entry = {"id": fields.get("ID", ""), "type": fields.get("Typ", ""), "fields": fields, "text": block.strip()}
+            if entry["type"] == "Interakcja":
+                subjects = [s.strip() for s in fields.get("Podmioty", "").split("+")]
+                if len(subjects) != 2:
+                    continue
+                entry["subjects"] = [[phrase_key(alt) for alt in s.split("/") if alt.strip()] for s in subjects]
+                self.interactions.append(entry)
+            else:
+                entry["name"] = fields.get("Nazwa", "")
+                entry["terms"] = self._entry_terms(fields)
+                self.entries.append(entry)
+
+    @staticmethod
+    def _entry_terms(fields: Dict[str, str]) -> set:
+        terms = set()
+        if fields.get("Nazwa"):
+            terms.add(phrase_key(fields["Nazwa"]))
+        substances = fields.get("Substancja") or fields.get("Substancje") or ""
+        for substance in substances.split("+"):
+            if substance.strip():
+                terms.add(phrase_key(substance))
+                for word in re.findall(r"\w+", substance):
+                    if len(word) >= 5:
+                        terms.add(phrase_key(word))
+        if fields.get("Grupa"):
+            terms.add(phrase_key(fields["Grupa"]))
+        return terms
+
+    def find_entry(self, drug: str) -> Optional[dict]:
+        self._ensure_loaded()
+        key = phrase_key(drug)
+        for entry in self.entries:
+            if key and key in entry["terms"]:
+                return entry
+        return None
+
+    def drug_terms(self, drug: str) -> set:
+        entry = self.find_entry(drug)
+        terms = {phrase_key(drug)}
+        if entry:
+            terms |= entry["terms"]
+        return terms
+
+    def find_interaction(self, drug_a: str, drug_b: str) -> Optional[dict]:
+        self._ensure_loaded()
+        terms_a = self.drug_terms(drug_a)
+        terms_b = self.drug_terms(drug_b)
+
+        matches = []
+        for interaction in self.interactions:
+            first, second = interaction["subjects"]
+            if (terms_a & set(first) and terms_b & set(second)) or (terms_a & set(second) and terms_b & set(first)):
+                fields = interaction["fields"]
+                effect = fields.get("Skutek", "")
+                matches.append({
+                    "id": interaction["id"],
+                    "subjects": fields.get("Podmioty", ""),
+                    "severity": fields.get("Nasilenie", ""),
+                    "effect": effect,
+                    "interakcja": "brak istotnych" not in effect.lower()
+                })
+
+        if not matches:
+            return None
+        return max(matches, key=lambda m: (m["interakcja"], SEVERITY_RANK.get(m["severity"], 0)))
+
+    def describe(self, drugs: List[str]) -> str:
+        texts = []
+        for drug in drugs:
+            entry = self.find_entry(drug)
+            if entry:
+                texts.append(entry["text"])
+        return "\n\n".join(texts)
+
+
+knowledge_base = KnowledgeBase()
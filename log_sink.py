@@ -0,0 +1,191 @@
+import atexit
+import csv
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("log_sink")
+
+records_written = metrics.counter(
+    "knowyourpill_log_records_written_total",
+    "Rekordy zapisane do pliku CSV z logami zapytań",
+    ("sink",)
+)
+records_dropped = metrics.counter(
+    "knowyourpill_log_records_dropped_total",
+    "Rekordy odrzucone przez pełną kolejkę lub błąd zapisu",
+    ("sink", "reason")
+)
+
+
+class CSVLogSink:
+    def __init__(self, path: str, header: Sequence[str], mode: str = "lock", max_queue: int = 10000,
+                 batch_size: int = 200, flush_interval: float = 1.0, max_bytes: int = 10 * 1024 * 1024,
+                 rotate_interval: float = 24 * 3600, backup_count: int = 7):
+        self.base_path = path
+        self.header = list(header)
+        self.mode = mode if fcntl is not None else "per_worker"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.name = os.path.basename(path)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    @property
+    def path(self) -> str:
+        if self.mode == "per_worker":
+            root, ext = os.path.splitext(self.base_path)
+            return f"{root}.{os.getpid()}{ext}"
+        return self.base_path
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=f"log-sink-{self.name}", daemon=True)
+                self._thread.start()
+
+    def write(self, row: Sequence):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(list(row))
+        except queue.Full:
+            records_dropped.inc(sink=self.name, reason="queue_full")
+
+    def _drain(self, first: Optional[list]) -> List[list]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                self._queue.put(None)
+                self._queue.task_done()
+                break
+            batch.append(row)
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                row = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if row is None:
+                batch = self._drain(None)
+                self._flush(batch)
+                self._done(len(batch) + 1)
+                return
+            batch = self._drain(row)
+            self._flush(batch)
+            self._done(len(batch))
+
+    def _done(self, count: int):
+        for _ in range(count):
+            self._queue.task_done()
+
+    def _should_rotate(self, path: str) -> bool:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size == 0:
+            return False
+        if self.max_bytes and stat.st_size >= self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and int(stat.st_mtime // self.rotate_interval) != int(time.time() // self.rotate_interval)
+
+    def _rotate(self, path: str):
+        root, ext = os.path.splitext(path)
+        target = f"{root}.{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}"
+        suffix = 1
+        while os.path.exists(target):
+            target = f"{root}.{datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}{ext}"
+            suffix += 1
+        os.replace(path, target)
+        logger.info(f"Rotacja logu: {path} -> {target}")
+
+        if self.backup_count:
+            backups = sorted(glob.glob(f"{glob.escape(root)}.[0-9]*-[0-9]*{ext}"), key=os.path.getmtime)
+            for old in backups[:-self.backup_count]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def _flush(self, batch: List[list]):
+        if not batch:
+            return
+        path = self.path
+        lock_file = None
+        try:
+            if self.mode == "lock":
+                lock_file = open(path + ".lock", "a")
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+
+            if self._should_rotate(path):
+                self._rotate(path)
+
+            file_exists = os.path.isfile(path) and os.path.getsize(path) > 0
+            with open(path, mode="a", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                if not file_exists:
+                    writer.writerow(self.header)
+                writer.writerows(batch)
+            records_written.inc(len(batch), sink=self.name)
+        except Exception as e:
+            logger.error(f"Błąd zapisu do CSV: {e}")
+            records_dropped.inc(len(batch), sink=self.name, reason="write_error")
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                lock_file.close()
+
+    def flush(self, timeout: float = 5.0):
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self, timeout: float = 5.0):
+        thread = self._thread
+        if thread is None or not thread.is_alive() or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+
+
+csv_log = CSVLogSink(
+    path=os.getenv("LOG_CSV_PATH", "logs_aggregate.csv"),
+    header=["timestamp", "query", "mode", "detected_drugs", "rag_status", "answer_length"],
+    mode=os.getenv("LOG_SINK_MODE", "lock"),
+    max_queue=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("LOG_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", "1.0")),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    rotate_interval=float(os.getenv("LOG_ROTATE_SECONDS", str(24 * 3600))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "7"))
+)
@@ -1,24 +1,39 @@
-from google import genai
-from google.genai import types, errors
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, Optional, List, Tuple, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 import os
 import json
 import logging
 import base64
-import csv
+import contextvars
+import hmac
 import re
+import threading
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 
-from guards import SecurityGuard
-from tools import registry, handle_genai_error
-from rag import rag_system
-
 load_dotenv(dotenv_path=".env.local")
 load_dotenv()
 
+from guards import SecurityGuard
+from tools import REGISTRY_PREFIX, registry, handle_genai_error, gemini_http_options, provider_timeout
+from rag import rag_system
+from knowledge import knowledge_base, phrase_key, term_key
+from extractor import drug_extractor, extraction_cache, heuristic_extract, query_cache_key
+from cache import TTLCache
+from context_packer import context_packer
+from metrics import metrics
+from tracing import RequestTrace, add_tokens, annotate, stage, use_trace
+from log_sink import csv_log
+from resilience import breakers
+from ratelimit import limiters
+from profiling import ProfilerBusy, profile_request
+from deadline import REQUEST_DEADLINE, Deadline, get_deadline, mark_if_expired, stage_allowed, use_deadline
+
 if not os.getenv("HF_TOKEN"):
     os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
     os.environ["HUGGINGFACE_HUB_VERBOSITY"] = "error"
@@ -26,7 +41,78 @@ if not os.getenv("HF_TOKEN"):
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("api")
 
-app = FastAPI(title="KnowYourPill API")
+WARMUP = os.getenv("WARMUP", "0") == "1"
+
+
+def warm_up():
+    started = time.perf_counter()
+    if os.getenv("GROQ_API_KEY"):
+        import groq
+        context_packer.counter("groq").load(download=True)
+    if os.getenv("GEMINI_API_KEY"):
+        from google import genai
+        context_packer.counter("gemini").load(download=True)
+    rag_system._ensure_indexed()
+    logger.info(f"Rozgrzewka zakończona w {time.perf_counter() - started:.1f}s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    yield
+
+
+app = FastAPI(title="KnowYourPill API", lifespan=lifespan)
+
+json_repairs = metrics.counter(
+    "knowyourpill_json_repairs_total",
+    "Naprawy niepoprawnego JSON z modelu: lokalnie (bez ponownego wywołania) lub ponownym zapytaniem",
+    ("provider", "method")
+)
+
+request_seconds = metrics.histogram(
+    "knowyourpill_request_duration_seconds",
+    "Czas obsługi żądań HTTP według endpointu (dla strumieni do wysłania nagłówków)",
+    ("endpoint",)
+)
+requests_total = metrics.counter(
+    "knowyourpill_requests_total",
+    "Żądania HTTP według endpointu i statusu",
+    ("endpoint", "status")
+)
+blocked_queries = metrics.counter(
+    "knowyourpill_blocked_queries_total",
+    "Zapytania zablokowane przez SecurityGuard (próby wstrzyknięcia, dane osobowe)"
+)
+hedge_wins = metrics.counter(
+    "knowyourpill_hedge_wins_total",
+    "Wygrane wyścigi syntezy w trybie hedged według dostawcy i roli (primary/secondary)",
+    ("provider", "role")
+)
+hedge_fired = metrics.counter(
+    "knowyourpill_hedge_fired_total",
+    "Uruchomienia zapasowego dostawcy w trybie hedged (powód: delay/failure)",
+    ("provider", "reason")
+)
+provider_latency = metrics.histogram(
+    "knowyourpill_provider_latency_seconds",
+    "Czas odpowiedzi dostawcy w trybie hedged według wyniku próby",
+    ("provider", "outcome")
+)
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY_MS", "1500")) / 1000
+HEDGE_PROVIDERS = {"groq": "gemini", "gemini": "groq"}
+PROVIDER_KEYS = {"groq": "GROQ_API_KEY", "gemini": "GEMINI_API_KEY"}
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+SYNTHESIS_MIN_TIME = float(os.getenv("SYNTHESIS_MIN_MS", "1000")) / 1000
+
+pair_cache = TTLCache(
+    max_size=int(os.getenv("PAIR_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("PAIR_CACHE_TTL", str(7 * 24 * 3600))),
+    name="pair"
+)
 
 
 class QueryRequest(BaseModel):
@@ -34,80 +120,188 @@ class QueryRequest(BaseModel):
     mode: str = "groq"
     use_functions: bool = True
     json_mode: bool = False
+    hedge: Optional[bool] = None
+    deadline_ms: Optional[int] = Field(None, ge=100, le=600000)
+    trace: bool = False
+
+
+class TraceSpan(BaseModel):
+    stage: str
+    parent: Optional[str] = None
+    start_ms: float
+    duration_ms: float
+    cached: Optional[bool] = None
+    tokens: Optional[int] = None
+    detail: Optional[str] = None
 
 
 class QueryResponse(BaseModel):
     answer: str
     logs: List[str]
+    cut_short: List[str] = []
+    timings: Optional[Dict[str, float]] = None
+    trace: Optional[List[TraceSpan]] = None
+    profile: Optional[str] = None
 
-def call_llm(prompt: str, context: str, mode: str = "gemini", tools_schema=None, json_mode: bool = False, retry_count: int = 0):
-    if mode == "gemini":
-        gemini_key = os.getenv("GEMINI_API_KEY")
-        if not gemini_key:
-            return "Błąd: Brak klucza API Gemini."
 
-        try:
-            client = genai.Client(api_key=gemini_key)
+class BatchQueryRequest(BaseModel):
+    items: List[QueryRequest] = Field(..., min_length=1, max_length=500)
+    max_concurrency: int = Field(4, ge=1, le=32)
+    stream: bool = False
 
-            tools = None
-            if tools_schema:
-                def identify_drugs(drug_name: str, drug_dose: Optional[str] = None, mode: str = "groq") -> str:
-                    return registry.validate_and_execute("identify_drugs", {"drug_name": drug_name, "drug_dose": drug_dose, "mode": mode})
 
-                tools = [identify_drugs]
+class BatchItemResult(BaseModel):
+    index: int
+    answer: Optional[str] = None
+    logs: List[str] = []
+    error: Optional[str] = None
+    status_code: int = 200
+    cut_short: List[str] = []
+    timings: Optional[Dict[str, float]] = None
+    trace: Optional[List[TraceSpan]] = None
 
-            json_instruction = ""
-            if json_mode:
-                json_instruction = "\nWAŻNE: Odpowiedz WYŁĄCZNIE w formacie JSON. Nie dodawaj żadnego wstępu ani zakończenia. Schemat: {\"answer\": \"Twoja odpowiedź\", \"interakcja\": true/false}"
 
-            full_prompt = f"""Jesteś asystentem medycznym KnowYourPill. Twoim zadaniem jest rzetelna i profesjonalna analiza bezpieczeństwa leków oraz ich interakcji.{json_instruction}
-            
-WAŻNE: 
-- Zawsze używaj OFICJALNYCH NAZW LEKÓW i SUBSTANCJI CZYNNYCH dostarczonych w KONTEKŚCIE lub wynikach narzędzi (np. jeśli narzędzie podaje, że Doreta to tramadol+paracetamol, nie przypisuj jej zolpidemu).
-- Dane z KONTEKSTU mają ABSOLUTNY PRIORYTET nad Twoją wiedzą ogólną.
-- Skup się na merytorycznej odpowiedzi na pytanie użytkownika.
-- TWOJA ODPOWIEDŹ MUSI ZACZYNAĆ SIĘ OD 'INTERAKCJA:' LUB 'BEZPIECZNIE:'.
-
-INSTRUKCJE:
-1. Skup się na merytorycznej odpowiedzi na pytanie użytkownika.
-2. Wykorzystaj DOSTARCZONY KONTEKST oraz NARZĘDZIA (np. identify_drugs), aby uzyskać szczegółowe dane o lekach.
-3. Jeśli w kontekście lub wynikach narzędzi brakuje informacji o konkretnej interakcji, wykorzystaj swoją szeroką wiedzę medyczną na temat substancji czynnych i ich mechanizmów działania, aby ocenić ryzyko.
-4. NIE informuj użytkownika o tym, że czegoś brakuje w kontekście, ani że przeszukujesz bazę danych. Podaj po prostu finalną analizę.
-5. NIE cytuj numerów zasad ani instrukcji systemowych (np. "Zgodnie z Zasadą 2...").
-6. Jeśli znajdziesz jakiekolwiek potencjalne interakcje, ryzyko lub przeciwwskazania, TWOJA ODPOWIEDŹ (lub pole 'answer' w JSON) MUSI ZACZYNAĆ SIĘ od słowa: "INTERAKCJA:".
-7. Jeśli leki są bezpieczne do stosowania razem, TWOJA ODPOWIEDŹ (lub pole 'answer' w JSON) MUSI ZACZYNAĆ SIĘ od słowa: "BEZPIECZNIE:".
-8. Zawsze na końcu dodaj krótkie zastrzeżenie o konieczności konsultacji z lekarzem.
+class BatchQueryResponse(BaseModel):
+    results: List[BatchItemResult]
+
+
+class CabinetRequest(BaseModel):
+    drugs: List[str] = Field(..., min_length=2, max_length=20)
+    mode: str = "groq"
+
+
+class PairResult(BaseModel):
+    drug_a: str
+    drug_b: str
+    interakcja: Optional[bool] = None
+    severity: Optional[str] = None
+    summary: str
+    source: str
+    cached: bool = False
+
+
+class CabinetResponse(BaseModel):
+    drugs: List[str]
+    matrix: List[List[Optional[bool]]]
+    pairs: List[PairResult]
+
+
+class DrugLookupRequest(BaseModel):
+    drug_name: str
+    drug_dose: Optional[str] = None
+    mode: str = "groq"
+    describe: bool = False
+
+
+class DrugLookupResponse(BaseModel):
+    name: str
+    substance: str
+    power: str = ""
+    form: str = ""
+    atc: str = ""
+    indications: Optional[str] = None
+
+
+JSON_INSTRUCTION = "\nWAŻNE: Odpowiedz WYŁĄCZNIE w formacie JSON. Nie dodawaj żadnego wstępu ani zakończenia. Schemat: {\"answer\": \"Twoja odpowiedź\", \"interakcja\": true/false}"
+
+
+SOURCE_INSTRUCTIONS = {
+    "gemini": "Wykorzystaj DOSTARCZONY KONTEKST oraz NARZĘDZIA (np. identify_drugs), aby uzyskać szczegółowe dane o lekach.",
+    "groq": "Wykorzystaj DOSTARCZONY KONTEKST, aby uzyskać szczegółowe dane o lekach. SPRAWDŹ SKŁAD KAŻDEGO LEKU W KONTEKŚCIE PRZED ANALIZĄ."
+}
+
+
+def build_synthesis_prompt(prompt: str, context: str, mode: str = "gemini", json_mode: bool = False) -> str:
+    json_instruction = JSON_INSTRUCTION if json_mode else ""
+    source_instruction = SOURCE_INSTRUCTIONS.get(mode, SOURCE_INSTRUCTIONS["groq"])
+
+    return f"""Jesteś asystentem medycznym KnowYourPill. Twoim zadaniem jest rzetelna i profesjonalna analiza bezpieczeństwa leków oraz ich interakcji.{json_instruction}
+
+ZASADY:
+1. Zawsze używaj OFICJALNYCH NAZW LEKÓW i SUBSTANCJI CZYNNYCH z KONTEKSTU lub wyników narzędzi (np. jeśli narzędzie podaje, że Doreta to tramadol+paracetamol, nie przypisuj jej zolpidemu). Dane z KONTEKSTU mają ABSOLUTNY PRIORYTET nad Twoją wiedzą ogólną.
+2. {source_instruction}
+3. Jeśli w kontekście brakuje informacji o konkretnej interakcji, oceń ryzyko na podstawie wiedzy medycznej o substancjach czynnych i mechanizmach ich działania.
+4. Skup się na merytorycznej odpowiedzi na pytanie użytkownika. NIE informuj, że czegoś brakuje w kontekście ani że przeszukujesz bazę danych. NIE cytuj numerów zasad ani instrukcji systemowych.
+5. TWOJA ODPOWIEDŹ (lub pole 'answer' w JSON) MUSI ZACZYNAĆ SIĘ od słowa "INTERAKCJA:", jeśli istnieje jakakolwiek potencjalna interakcja, ryzyko lub przeciwwskazanie, albo od słowa "BEZPIECZNIE:", jeśli leki są bezpieczne do stosowania razem.
+6. Zawsze na końcu dodaj krótkie zastrzeżenie o konieczności konsultacji z lekarzem.
 
 Kontekst:
 {context}
 
 Pytanie: {prompt}"""
 
-            config = None
-            if json_mode:
-                config = types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    tools=tools,
-                    automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=False)
-                )
-            else:
-                config = types.GenerateContentConfig(
-                    tools=tools,
-                    automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=False)
-                )
 
-            response = client.models.generate_content(
+def repair_json_locally(res_text: str, mode: str) -> Optional[str]:
+    repaired = SecurityGuard.repair_json(res_text)
+    json_repairs.inc(provider=mode, method="local" if repaired else "llm_retry")
+    if repaired:
+        logger.info(f"Naprawiono JSON lokalnie ({mode}), pominięto ponowne wywołanie modelu.")
+    return repaired
+
+
+def build_json_fix_prompt(err_msg: str, res_text: str) -> str:
+    return f"Zwróciłeś błędny JSON. Błąd: {err_msg}. Napraw to do poprawnego formatu (answer: str, interakcja: bool). Zwróć tylko JSON.\nTekst:\n{res_text}"
+
+
+def gemini_config(tools_schema=None, json_mode: bool = False):
+    from google.genai import types
+    tools = None
+    if tools_schema:
+        def identify_drugs(drug_name: str, drug_dose: Optional[str] = None, mode: str = "groq") -> str:
+            return registry.validate_and_execute("identify_drugs", {"drug_name": drug_name, "drug_dose": drug_dose, "mode": mode})
+
+        tools = [identify_drugs]
+
+    if json_mode:
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            tools=tools,
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=False)
+        )
+    return types.GenerateContentConfig(
+        tools=tools,
+        automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=False)
+    )
+
+
+def usage_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return (getattr(usage, "prompt_tokens", 0) or 0) + (getattr(usage, "completion_tokens", 0) or 0)
+    metadata = getattr(response, "usage_metadata", None)
+    return getattr(metadata, "total_token_count", None) if metadata is not None else None
+
+
+def call_llm(prompt: str, context: str, mode: str = "gemini", tools_schema=None, json_mode: bool = False, retry_count: int = 0):
+    if mode == "gemini":
+        gemini_key = os.getenv("GEMINI_API_KEY")
+        if not gemini_key:
+            return "Błąd: Brak klucza API Gemini."
+
+        try:
+            from google import genai
+            client = genai.Client(api_key=gemini_key, http_options=gemini_http_options())
+            full_prompt = build_synthesis_prompt(prompt, context, mode=mode, json_mode=json_mode)
+
+            limiters.acquire("gemini", "gemini-2.0-flash", full_prompt, 1024)
+            response = breakers.call(
+                "gemini",
+                client.models.generate_content,
                 model='gemini-2.0-flash',
                 contents=full_prompt,
-                config=config
+                config=gemini_config(tools_schema, json_mode)
             )
             res_text = response.text
+            add_tokens(usage_tokens(response))
 
             if json_mode and retry_count < 2:
                 is_valid, err_msg = SecurityGuard.is_valid_json(res_text)
                 if not is_valid:
+                    repaired = repair_json_locally(res_text, mode)
+                    if repaired:
+                        return repaired
                     logger.info(f"Naprawa JSON (Gemini, próba {retry_count + 1}). Błąd: {err_msg}")
-                    fix_prompt = f"Zwróciłeś błędny JSON. Błąd: {err_msg}. Napraw to do poprawnego formatu (answer: str, interakcja: bool). Zwróć tylko JSON.\nTekst:\n{res_text}"
+                    fix_prompt = build_json_fix_prompt(err_msg, res_text)
                     return call_llm(fix_prompt, context, mode=mode, tools_schema=None, json_mode=True, retry_count=retry_count + 1)
 
             return res_text
@@ -120,40 +314,17 @@ Pytanie: {prompt}"""
 
         try:
             from groq import Groq
-            client = Groq(api_key=groq_key)
-
-            json_instruction = ""
-            if json_mode:
-                json_instruction = "\nWAŻNE: Odpowiedz WYŁĄCZNIE w formacie JSON. Nie dodawaj żadnego wstępu ani zakończenia. Schemat: {\"answer\": \"Twoja odpowiedź\", \"interakcja\": true/false}"
-
-            full_prompt = f"""Jesteś asystentem medycznym KnowYourPill. Twoim zadaniem jest rzetelna i profesjonalna analiza bezpieczeństwa leków oraz ich interakcji.{json_instruction}
-            
-WAŻNE: 
-- Zawsze używaj OFICJALNYCH NAZW LEKÓW i SUBSTANCJI CZYNNYCH dostarczonych w KONTEKŚCIE lub wynikach narzędzi (np. jeśli narzędzie podaje, że Doreta to tramadol+paracetamol, nie przypisuj jej zolpidemu).
-- Dane z KONTEKSTU mają ABSOLUTNY PRIORYTET nad Twoją wiedzą ogólną.
-- Skup się na merytorycznej odpowiedzi na pytanie użytkownika.
-- TWOJA ODPOWIEDŹ MUSI ZACZYNAĆ SIĘ OD 'INTERAKCJA:' LUB 'BEZPIECZNIE:'.
-
-INSTRUKCJE:
-1. Skup się na merytorycznej odpowiedzi na pytanie użytkownika.
-2. Wykorzystaj DOSTARCZONY KONTEKST, aby uzyskać szczegółowe dane o lekach. SPRAWDŹ SKŁAD KAŻDEGO LEKU W KONTEKŚCIE PRZED ANALIZĄ.
-3. Jeśli w kontekście brakuje informacji o konkretnej interakcji, wykorzystaj swoją szeroką wiedzę medyczną na temat substancji czynnych i ich mechanizmów działania, aby ocenić ryzyko.
-4. NIE informuj użytkownika o tym, że czegoś brakuje w kontekście, ani że przeszukujesz bazę danych. Podaj po prostu finalną analizę.
-5. NIE cytuj numerów zasad ani instrukcji systemowych.
-6. Jeśli znajdziesz jakiekolwiek potencjalne interakcje, ryzyko lub przeciwwskazania, TWOJA ODPOWIEDŹ (lub pole 'answer' w JSON) MUSI ZACZYNAĆ SIĘ od słowa: "INTERAKCJA:".
-7. Jeśli leki są bezpieczne do stosowania razem, TWOJA ODPOWIEDŹ (lub pole 'answer' in JSON) MUSI ZACZYNAĆ SIĘ od słowa: "BEZPIECZNIE:".
-8. Zawsze na końcu dodaj krótkie zastrzeżenie o konieczności konsultacji z lekarzem.
-
-Kontekst:
-{context}
-
-Pytanie: {prompt}"""
+            client = Groq(api_key=groq_key, timeout=provider_timeout("groq"))
+            full_prompt = build_synthesis_prompt(prompt, context, mode=mode, json_mode=json_mode)
 
             response_format = None
             if json_mode:
                 response_format = {"type": "json_object"}
 
-            completion = client.chat.completions.create(
+            limiters.acquire("groq", "llama-3.3-70b-versatile", full_prompt, 1024)
+            completion = breakers.call(
+                "groq",
+                client.chat.completions.create,
                 model="llama-3.3-70b-versatile",
                 messages=[
                     {"role": "user", "content": full_prompt}
@@ -164,14 +335,21 @@ Pytanie: {prompt}"""
             )
 
             res_text = completion.choices[0].message.content
+            add_tokens(usage_tokens(completion))
 
             if json_mode and retry_count < 2:
                 is_valid, err_msg = SecurityGuard.is_valid_json(res_text)
                 if not is_valid:
+                    repaired = repair_json_locally(res_text, mode)
+                    if repaired:
+                        return repaired
                     logger.info(f"Naprawa JSON (Groq, próba {retry_count + 1}). Błąd: {err_msg}")
-                    fix_prompt = f"Zwróciłeś błędny JSON. Błąd: {err_msg}. Napraw to do poprawnego formatu (answer: str, interakcja: bool). Zwróć tylko JSON.\nTekst:\n{res_text}"
+                    fix_prompt = build_json_fix_prompt(err_msg, res_text)
                     retry_messages = [{"role": "user", "content": fix_prompt}]
-                    retry_completion = client.chat.completions.create(
+                    limiters.acquire("groq", "llama-3.3-70b-versatile", fix_prompt, 512)
+                    retry_completion = breakers.call(
+                        "groq",
+                        client.chat.completions.create,
                         model="llama-3.3-70b-versatile",
                         messages=retry_messages,
                         temperature=0,
@@ -179,8 +357,12 @@ Pytanie: {prompt}"""
                         response_format={"type": "json_object"}
                     )
                     res_text = retry_completion.choices[0].message.content
+                    add_tokens(usage_tokens(retry_completion))
                     is_valid, _ = SecurityGuard.is_valid_json(res_text)
-                    if not is_valid and retry_count < 1: 
+                    if not is_valid:
+                        res_text = SecurityGuard.repair_json(res_text) or res_text
+                        is_valid, _ = SecurityGuard.is_valid_json(res_text)
+                    if not is_valid and retry_count < 1:
                          return call_llm(prompt, context, mode=mode, tools_schema=tools_schema, json_mode=json_mode, retry_count=retry_count + 1)
 
             return res_text
@@ -190,6 +372,187 @@ Pytanie: {prompt}"""
         return "Nieobsługiwany tryb"
 
 
+def stream_llm(prompt: str, context: str, mode: str = "gemini", tools_schema=None, json_mode: bool = False,
+               deadline: Optional[Deadline] = None) -> Iterator[str]:
+    deadline = deadline or get_deadline()
+    full_prompt = build_synthesis_prompt(prompt, context, mode=mode, json_mode=json_mode)
+
+    if mode == "gemini":
+        gemini_key = os.getenv("GEMINI_API_KEY")
+        if not gemini_key:
+            yield "Błąd: Brak klucza API Gemini."
+            return
+
+        breaker = breakers.get("gemini")
+        with use_deadline(deadline):
+            from google import genai
+            client = genai.Client(api_key=gemini_key, http_options=gemini_http_options())
+            limiters.acquire("gemini", "gemini-2.0-flash", full_prompt, 1024)
+        breaker.before()
+        started = time.perf_counter()
+        try:
+            for chunk in client.models.generate_content_stream(
+                model='gemini-2.0-flash',
+                contents=full_prompt,
+                config=gemini_config(tools_schema, json_mode)
+            ):
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            breaker.failure(e)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.success(time.perf_counter() - started)
+    elif mode == "groq":
+        groq_key = os.getenv("GROQ_API_KEY")
+        if not groq_key:
+            yield "Błąd: Brak klucza API Groq."
+            return
+
+        from groq import Groq
+        breaker = breakers.get("groq")
+        with use_deadline(deadline):
+            client = Groq(api_key=groq_key, timeout=provider_timeout("groq"))
+            limiters.acquire("groq", "llama-3.3-70b-versatile", full_prompt, 1024)
+        breaker.before()
+        started = time.perf_counter()
+        stream = None
+        try:
+            stream = client.chat.completions.create(
+                model="llama-3.3-70b-versatile",
+                messages=[{"role": "user", "content": full_prompt}],
+                temperature=0.2,
+                max_tokens=1024,
+                response_format={"type": "json_object"} if json_mode else None,
+                stream=True
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            breaker.failure(e)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        finally:
+            if stream is not None:
+                stream.close()
+        breaker.success(time.perf_counter() - started)
+    else:
+        yield "Nieobsługiwany tryb"
+
+
+VERDICT_JSON_REGEX = re.compile(r'"answer"\s*:\s*"\s*(INTERAKCJA|BEZPIECZNIE)')
+
+
+def detect_verdict(text: str, json_mode: bool = False) -> Optional[str]:
+    if json_mode:
+        match = VERDICT_JSON_REGEX.search(text)
+        return match.group(1) if match else None
+
+    head = text.lstrip(" \n*#>")
+    for verdict in ["INTERAKCJA", "BEZPIECZNIE"]:
+        if head.startswith(verdict + ":"):
+            return verdict
+    return None
+
+
+def validate_answer(text: Optional[str], json_mode: bool = False) -> Optional[str]:
+    if not text:
+        return None
+    if json_mode:
+        is_valid, _ = SecurityGuard.is_valid_json(text)
+        if not is_valid:
+            text = SecurityGuard.repair_json(text)
+            if not text:
+                return None
+    if detect_verdict(text, json_mode) is None:
+        return None
+    return text
+
+
+def run_hedge_attempt(prompt: str, context: str, mode: str, json_mode: bool, cancel: threading.Event) -> Tuple[str, bool]:
+    parts = []
+    stream = stream_llm(prompt, context, mode=mode, tools_schema=True, json_mode=json_mode)
+    try:
+        for token in stream:
+            if cancel.is_set():
+                return "".join(parts), True
+            parts.append(token)
+    finally:
+        stream.close()
+    return "".join(parts), False
+
+
+def hedged_call_llm(prompt: str, context: str, mode: str = "groq", json_mode: bool = False, logs: Optional[List[str]] = None) -> str:
+    secondary = HEDGE_PROVIDERS.get(mode)
+    if not secondary or not os.getenv(PROVIDER_KEYS[secondary]) or not breakers.available(secondary):
+        return call_llm(prompt, context, mode=mode, tools_schema=True, json_mode=json_mode)
+
+    started = time.perf_counter()
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=2)
+    roles = {}
+
+    def attempt(provider: str):
+        attempt_started = time.perf_counter()
+        outcome = "error"
+        try:
+            text, cancelled = run_hedge_attempt(prompt, context, provider, json_mode, cancel)
+            if cancelled:
+                outcome = "cancelled"
+                return None
+            answer = validate_answer(text, json_mode)
+            outcome = "valid" if answer else "invalid"
+            return answer
+        except Exception as e:
+            logger.warning(f"Hedged: błąd dostawcy {provider}: {e}")
+            return None
+        finally:
+            provider_latency.observe(time.perf_counter() - attempt_started, provider=provider, outcome=outcome)
+
+    def launch(provider: str, role: str):
+        roles[executor.submit(contextvars.copy_context().run, attempt, provider)] = (provider, role)
+
+    launch(mode, "primary")
+    pending = set(roles)
+    winner = None
+    try:
+        while pending and winner is None:
+            hedged = len(roles) > 1
+            done, pending = wait(pending, timeout=None if hedged else HEDGE_DELAY, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_fired.inc(provider=secondary, reason="delay")
+                launch(secondary, "secondary")
+                pending = {f for f in roles if not f.done()}
+                continue
+
+            for future in done:
+                if future.result():
+                    winner = future
+                    break
+            if winner is None and not hedged:
+                hedge_fired.inc(provider=secondary, reason="failure")
+                launch(secondary, "secondary")
+                pending = {f for f in roles if not f.done()}
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False)
+
+    if winner is None:
+        logger.warning("Hedged: żaden dostawca nie zwrócił poprawnej odpowiedzi, używam zwykłego wywołania.")
+        return call_llm(prompt, context, mode=mode, tools_schema=True, json_mode=json_mode)
+
+    provider, role = roles[winner]
+    hedge_wins.inc(provider=provider, role=role)
+    if logs is not None:
+        logs.append(f"Synteza hedged: odpowiedź z {provider} ({role}) po {time.perf_counter() - started:.2f}s")
+    return winner.result()
+
+
 def local_llm_stub(query: str, context: str, tool_result: str = "") -> str:
     answer = "### Analiza bezpieczeństwa (Baza lokalna)\n\n"
 
@@ -359,132 +722,209 @@ def local_llm_stub(query: str, context: str, tool_result: str = "") -> str:
     return answer
 
 def log_to_csv(query, mode, drugs, rag_status, answer_length):
-    file_path = "logs_aggregate.csv"
-    file_exists = os.path.isfile(file_path)
-    
-    try:
-        with open(file_path, mode='a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            if not file_exists:
-                writer.writerow(["timestamp", "query", "mode", "detected_drugs", "rag_status", "answer_length"])
-            
-            writer.writerow([
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                query,
-                mode,
-                ", ".join(drugs) if drugs else "None",
-                rag_status,
-                answer_length
-            ])
-    except Exception as e:
-        logger.error(f"Błąd zapisu do CSV: {e}")
-
+    csv_log.write([
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        query,
+        mode,
+        ", ".join(drugs) if drugs else "None",
+        rag_status,
+        answer_length
+    ])
 
-@app.post("/ask", response_model=QueryResponse)
-async def ask_endpoint(request: QueryRequest):
-    logs = []
-    query = request.query
-    logs.append(f"Zapytanie: {query}")
 
+def check_query(query: str) -> str:
     is_attack, msg = SecurityGuard.check_injection(query)
     if is_attack:
         logger.warning(f"Zablokowano atak: {msg}")
+        blocked_queries.inc()
         raise HTTPException(status_code=400, detail=msg)
 
-    clean_query = SecurityGuard.sanitize_input(query)
+    return SecurityGuard.sanitize_input(query)
 
-    logs.append("Weryfikacja bezpieczeństwa: OK")
 
-    tool_result = ""
-    all_tool_results = []
-    potential_drugs = []
+def merge_drugs(*groups: List[str]) -> List[str]:
+    merged = {}
+    for drug in (d for group in groups for d in group):
+        merged.setdefault(term_key(drug), drug)
+    return list(merged.values())
 
-    extraction_prompt = f"""Wypisz TYLKO nazwy leków lub substancji czynnych występujące w poniższym zapytaniu, w mianowniku liczby pojedynczej, oddzielone przecinkami. 
-Przykłady: 
+
+@stage("extraction")
+def extract_drugs(clean_query: str, mode: str, logs: List[str]) -> List[str]:
+    dictionary_drugs, leftovers = drug_extractor.extract_with_leftovers(clean_query)
+    if dictionary_drugs:
+        logs.append(f"Wykryte leki (słownik): {dictionary_drugs}")
+        annotate(detail="dictionary")
+        if not leftovers:
+            return dictionary_drugs
+        logs.append(f"Nierozpoznane słowa w zapytaniu, pytam model: {leftovers}")
+
+    cache_key = query_cache_key(clean_query)
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        logs.append(f"Wykryte leki (pamięć podręczna): {cached}")
+        annotate(cached=True, detail="cache")
+        return merge_drugs(dictionary_drugs, cached) or heuristic_extract(clean_query)
+
+    extraction_prompt = f"""Wypisz TYLKO nazwy leków lub substancji czynnych występujące w poniższym zapytaniu, w mianowniku liczby pojedynczej, oddzielone przecinkami.
+Przykłady:
 - 'Doretę' -> 'Doreta'
 - 'Xanaxem' -> 'Xanax'
 - 'Paracetamolu' -> 'Paracetamol'
 
-WAŻNE: 
-- Popraw oczywiste literówki. 
+WAŻNE:
+- Popraw oczywiste literówki.
 - Zwróć tylko nazwy, bez żadnych dodatkowych słów.
-- NIE traktuj czasowników takich jak 'mieszać', 'brać', 'stosować', 'używać', 'łączyć' jako nazw leków. 
+- NIE traktuj czasowników takich jak 'mieszać', 'brać', 'stosować', 'używać', 'łączyć' jako nazw leków.
 - Jeśli nie ma nazw leków, zwróć puste pole.
 Zapytanie: {clean_query}"""
 
-    if request.mode == "local":
+    if mode == "local":
         extraction_modes = ["groq", "gemini"]
     else:
-        extraction_modes = [request.mode]
+        extraction_modes = [mode]
 
+    potential_drugs = []
+    llm_answered = False
     for ex_mode in extraction_modes:
+        if not stage_allowed("extraction"):
+            break
         try:
-            llm_extracted = ""
+            llm_extracted = None
             if ex_mode == "gemini":
                 gemini_key = os.getenv("GEMINI_API_KEY")
                 if gemini_key:
-                    client = genai.Client(api_key=gemini_key)
-                    ex_res = client.models.generate_content(model='gemini-2.0-flash', contents=extraction_prompt)
+                    from google import genai
+                    client = genai.Client(api_key=gemini_key, http_options=gemini_http_options())
+                    limiters.acquire("gemini", "gemini-2.0-flash", extraction_prompt, 100)
+                    ex_res = breakers.call("gemini", client.models.generate_content, model='gemini-2.0-flash', contents=extraction_prompt)
                     llm_extracted = ex_res.text.strip()
+                    add_tokens(usage_tokens(ex_res))
             elif ex_mode == "groq":
                 groq_key = os.getenv("GROQ_API_KEY")
                 if groq_key:
                     from groq import Groq
-                    client = Groq(api_key=groq_key)
-                    completion = client.chat.completions.create(
+                    client = Groq(api_key=groq_key, timeout=provider_timeout("groq"))
+                    limiters.acquire("groq", "llama-3.3-70b-versatile", extraction_prompt, 100)
+                    completion = breakers.call(
+                        "groq",
+                        client.chat.completions.create,
                         model="llama-3.3-70b-versatile",
                         messages=[{"role": "user", "content": extraction_prompt}],
                         temperature=0,
                         max_tokens=100,
                     )
                     llm_extracted = completion.choices[0].message.content.strip()
+                    add_tokens(usage_tokens(completion))
 
-            if llm_extracted:
+            if llm_extracted is not None:
+                llm_answered = True
                 llm_extracted = llm_extracted.replace("- ", "").replace("* ", "").replace(".", "").replace("\n", ",")
                 potential_drugs = [d.strip() for d in llm_extracted.split(",") if len(d.strip()) >= 3]
                 if potential_drugs:
                     logs.append(f"Wykryte leki ({ex_mode}): {potential_drugs}")
+                    annotate(detail=ex_mode)
                     break
         except Exception as e:
+            mark_if_expired("extraction")
             logger.error(f"Błąd ekstrakcji ({ex_mode}): {e}")
             logs.append(f"Błąd ekstrakcji leków ({ex_mode}): {handle_genai_error(e)}")
 
+    if llm_answered:
+        extraction_cache.set(cache_key, potential_drugs)
+        learned = drug_extractor.learn_aliases(clean_query, potential_drugs)
+        if learned:
+            logger.info(f"Nowe formy nazw leków: {learned}")
+
+    if dictionary_drugs:
+        return merge_drugs(dictionary_drugs, potential_drugs)
     if not potential_drugs:
-        words = clean_query.split()
-        for word in words:
-            clean_word = word.strip("?,.!")
-            if len(clean_word) < 3: continue
-
-            base_word = clean_word
-            for suffix in ["em", "u", "a"]:
-                if clean_word.endswith(suffix) and len(clean_word) > len(suffix) + 2:
-                    base_word = clean_word[:-len(suffix)]
-                    break
+        potential_drugs = heuristic_extract(clean_query)
+        annotate(detail="heuristic")
+
+    return list(dict.fromkeys(potential_drugs))
+
+
+class CallMemo:
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, func):
+        with self._lock:
+            future = self._futures.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._futures[key] = Future()
+
+        if is_owner:
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def learn_registry_name(drug: str, res: str):
+    if not res.startswith("Dane z Rejestru: "):
+        return
+    try:
+        name = json.loads(res.split("Dane z Rejestru: ", 1)[1]).get("name", "")
+    except:
+        return
 
-            if base_word[0].isupper() or len(base_word) >= 5:
-                if base_word.lower() not in ["czy", "mogę", "brać", "jak", "jest", "razem", "podaj", "skład", "leku", "mieszać", "stosować", "łączyć", "używać"]:
-                    potential_drugs.append(base_word)
+    words = name.split()
+    if words and term_key(words[0]) == term_key(drug):
+        drug_extractor.add_terms([drug])
 
-    potential_drugs = list(dict.fromkeys(potential_drugs))
+
+def run_identify_drugs(args: dict, memo: Optional[CallMemo] = None) -> str:
+    with stage("registry_lookup", detail=args.get("drug_name")):
+        if memo is None:
+            res = registry.validate_and_execute("identify_drugs", args)
+        else:
+            executed = []
+
+            def execute():
+                executed.append(True)
+                return registry.validate_and_execute("identify_drugs", args)
+
+            key = (args.get("drug_name", "").lower(), args.get("drug_dose"), args.get("mode"))
+            res = memo.get(key, execute)
+            if not executed:
+                annotate(cached=True)
+
+    learn_registry_name(args.get("drug_name", ""), res)
+    return res
+
+
+@stage("registry")
+def lookup_drugs(clean_query: str, potential_drugs: List[str], request: QueryRequest, logs: List[str], memo: Optional[CallMemo] = None) -> Tuple[str, List[str]]:
+    tool_result = ""
+    all_tool_results = []
 
     if (request.mode == "gemini" or request.mode == "groq") and request.use_functions:
         try:
             if "Podaj skład leku" in clean_query or request.mode == "groq":
                 for drug in potential_drugs:
+                    if not stage_allowed("registry"):
+                        break
                     dose_hint = None
                     if " dawka " in clean_query.lower():
                         dose_hint = clean_query.lower().split(" dawka ")[-1].strip()
-                    elif " dawki " in clean_query.lower(): 
+                    elif " dawki " in clean_query.lower():
                         dose_hint = clean_query.lower().split(" dawki ")[-1].strip()
-                    
-                    res = registry.validate_and_execute("identify_drugs", {"drug_name": drug, "drug_dose": dose_hint, "mode": request.mode})
+
+                    res = run_identify_drugs({"drug_name": drug, "drug_dose": dose_hint, "mode": request.mode}, memo)
                     all_tool_results.append(res)
                     logs.append(f"Dane z rejestru dla {drug}: {res}")
                 tool_result = "\n".join(all_tool_results)
-            
+
             elif request.mode == "gemini" and "Podaj skład leku" in clean_query:
                  for drug in potential_drugs:
-                    res = registry.validate_and_execute("identify_drugs", {"drug_name": drug, "mode": request.mode})
+                    if not stage_allowed("registry"):
+                        break
+                    res = run_identify_drugs({"drug_name": drug, "mode": request.mode}, memo)
                     all_tool_results.append(res)
                     logs.append(f"Dane z rejestru dla {drug}: {res}")
                  tool_result = "\n".join(all_tool_results)
@@ -495,12 +935,18 @@ Zapytanie: {clean_query}"""
     elif request.mode == "local" and request.use_functions:
         if potential_drugs:
             for drug in potential_drugs:
-                res = registry.validate_and_execute("identify_drugs", {"drug_name": drug, "mode": request.mode})
+                if not stage_allowed("registry"):
+                    break
+                res = run_identify_drugs({"drug_name": drug, "mode": request.mode}, memo)
                 all_tool_results.append(res)
                 logs.append(f"Wynik narzędzia ({drug}): {res}")
 
             tool_result = "\n".join(all_tool_results)
 
+    return tool_result, all_tool_results
+
+
+def build_rag_query(clean_query: str, all_tool_results: List[str]) -> str:
     rag_query = clean_query
 
     if all_tool_results:
@@ -519,36 +965,445 @@ Zapytanie: {clean_query}"""
 
         rag_query += " " + " ".join(substances_found)
 
-    rag_context = rag_system.search(rag_query, k=15)
-    logs.append(f"Kontekst RAG pobrany.")
+    return rag_query
+
+
+def finalize_answer(final_answer, json_mode: bool = False) -> str:
+    if hasattr(final_answer, 'content') and final_answer.content is not None:
+        final_answer = final_answer.content
+    elif not isinstance(final_answer, str):
+        final_answer = str(final_answer)
+
+    if not json_mode:
+        final_answer = SecurityGuard.validate_output(final_answer)
+    return final_answer
+
+
+@stage("context_packing")
+def pack_context(clean_query: str, rag_records: List[dict], tool_result: str, request: QueryRequest, logs: List[str]) -> str:
+    context, stats = context_packer.pack(clean_query, rag_records, tool_result, request.mode)
+    prompt_tokens = context_packer.count(build_synthesis_prompt(clean_query, context, request.mode, request.json_mode), request.mode)
+    approx = "" if stats["exact_tokens"] else "~"
+    annotate(tokens=prompt_tokens, detail=f"kontekst {stats['context_tokens']}/{stats['budget']}")
+    logs.append(
+        f"Tokeny promptu ({request.mode}): {approx}{prompt_tokens}, kontekst {stats['context_tokens']}/{stats['budget']}, "
+        f"rekordy RAG {stats['records_used']}/{stats['records_total']} (duplikaty: {stats['records_duplicate']})"
+    )
+    return context
+
+
+def provider_available(mode: str, logs: List[str]) -> bool:
+    if mode not in PROVIDER_KEYS:
+        return False
+    if breakers.available(mode):
+        return True
+    logs.append(f"Dostawca {mode} chwilowo niedostępny (otwarty bezpiecznik) - odpowiedź z bazy lokalnej.")
+    return False
+
+
+def request_deadline(request: QueryRequest) -> Deadline:
+    return Deadline(request.deadline_ms / 1000 if request.deadline_ms else REQUEST_DEADLINE)
+
+
+def trace_fields(trace: Optional[RequestTrace]) -> dict:
+    if trace is None:
+        return {}
+    return {"timings": trace.timings(), "trace": trace.export()}
 
-    if request.mode == "gemini" or request.mode == "groq":
-        try:
-            final_answer = call_llm(clean_query, f"{rag_context}\nInfo: {tool_result}", mode=request.mode,
-                                    tools_schema=True, json_mode=request.json_mode)
 
-            if hasattr(final_answer, 'content') and final_answer.content is not None:
-                final_answer = final_answer.content
-            elif not isinstance(final_answer, str):
-                final_answer = str(final_answer)
+def report_cut_short(deadline: Deadline, logs: List[str]) -> List[str]:
+    if deadline.cut_short:
+        logs.append(f"Przekroczono budżet czasu zapytania, skrócone etapy: {', '.join(deadline.cut_short)}")
+    return list(deadline.cut_short)
 
+
+@stage("rag")
+def search_rag(clean_query: str, all_tool_results: List[str], logs: List[str]) -> List[dict]:
+    if not stage_allowed("rag"):
+        return []
+    rag_records = rag_system.search_records(build_rag_query(clean_query, all_tool_results), k=15)
+    logs.append("Kontekst RAG pobrany.")
+    return rag_records
+
+
+@stage("synthesis")
+def synthesize(clean_query: str, rag_records: List[dict], tool_result: str, request: QueryRequest, logs: List[str]) -> str:
+    if provider_available(request.mode, logs) and stage_allowed("synthesis", SYNTHESIS_MIN_TIME):
+        try:
+            context = pack_context(clean_query, rag_records, tool_result, request, logs)
+            if request.hedge if request.hedge is not None else HEDGE_ENABLED:
+                final_answer = hedged_call_llm(clean_query, context, mode=request.mode,
+                                               json_mode=request.json_mode, logs=logs)
+            else:
+                final_answer = call_llm(clean_query, context, mode=request.mode,
+                                        tools_schema=True, json_mode=request.json_mode)
         except Exception as e:
             logger.error(f"Błąd syntezy: {e}")
             final_answer = f"Usługa niedostępna: {str(e)}"
+
+        if isinstance(final_answer, str) and detect_verdict(final_answer, request.json_mode) is None and mark_if_expired("synthesis"):
+            final_answer = local_llm_stub(clean_query, rag_system.format_records(rag_records), tool_result)
     else:
-        final_answer = local_llm_stub(clean_query, rag_context, tool_result)
+        final_answer = local_llm_stub(clean_query, rag_system.format_records(rag_records), tool_result)
+
+    return finalize_answer(final_answer, request.json_mode)
+
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        endpoint = getattr(request.scope.get("route"), "path", "unmatched")
+        request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        requests_total.inc(endpoint=endpoint, status=str(status))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/ask", response_model=QueryResponse)
+def ask_endpoint(request: QueryRequest, profile: bool = False, x_profile: Optional[str] = Header(None),
+                 x_admin_token: Optional[str] = Header(None)):
+    if not profile and not x_profile:
+        return run_ask(request)
+
+    require_admin(x_admin_token)
+    try:
+        with profile_request("ask") as artifact:
+            response = run_ask(request)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    response.profile = artifact["path"]
+    response.logs.append(f"Profil zapytania: {artifact['path']}")
+    return response
+
+
+def run_ask(request: QueryRequest) -> QueryResponse:
+    logs = []
+    query = request.query
+    logs.append(f"Zapytanie: {query}")
+
+    clean_query = check_query(query)
+
+    logs.append("Weryfikacja bezpieczeństwa: OK")
+
+    deadline = request_deadline(request)
+    trace = RequestTrace() if request.trace else None
+    with deadline.scope(), use_trace(trace):
+        potential_drugs = extract_drugs(clean_query, request.mode, logs)
+        tool_result, all_tool_results = lookup_drugs(clean_query, potential_drugs, request, logs)
+        rag_records = search_rag(clean_query, all_tool_results, logs)
+        final_answer = synthesize(clean_query, rag_records, tool_result, request, logs)
+    cut_short = report_cut_short(deadline, logs)
 
-    if not request.json_mode:
-        final_answer = SecurityGuard.validate_output(final_answer)
-    
     log_to_csv(
         query=query,
         mode=request.mode,
         drugs=potential_drugs,
-        rag_status="Success" if rag_context else "Empty",
+        rag_status="Success" if rag_records else "Empty",
+        answer_length=len(final_answer)
+    )
+
+    return QueryResponse(answer=final_answer, logs=logs, cut_short=cut_short, **trace_fields(trace))
+
+
+def prepare_batch_item(index: int, request: QueryRequest, extraction_memo: CallMemo, registry_memo: CallMemo) -> dict:
+    logs = [f"Zapytanie: {request.query}"]
+    clean_query = check_query(request.query)
+    logs.append("Weryfikacja bezpieczeństwa: OK")
+
+    def run_extraction():
+        extraction_logs = []
+        return extract_drugs(clean_query, request.mode, extraction_logs), extraction_logs
+
+    deadline = request_deadline(request)
+    trace = RequestTrace() if request.trace else None
+    with deadline.scope(), use_trace(trace):
+        potential_drugs, extraction_logs = extraction_memo.get((clean_query, request.mode), run_extraction)
+        logs.extend(extraction_logs)
+        tool_result, all_tool_results = lookup_drugs(clean_query, potential_drugs, request, logs, memo=registry_memo)
+
+    return {
+        "index": index,
+        "request": request,
+        "logs": logs,
+        "clean_query": clean_query,
+        "potential_drugs": potential_drugs,
+        "tool_result": tool_result,
+        "rag_query": build_rag_query(clean_query, all_tool_results),
+        "deadline": deadline,
+        "trace": trace
+    }
+
+
+def finish_batch_item(item: dict) -> BatchItemResult:
+    request = item["request"]
+    with item["deadline"].scope(), use_trace(item["trace"]):
+        final_answer = synthesize(item["clean_query"], item["rag_records"], item["tool_result"], request, item["logs"])
+    cut_short = report_cut_short(item["deadline"], item["logs"])
+
+    log_to_csv(
+        query=request.query,
+        mode=request.mode,
+        drugs=item["potential_drugs"],
+        rag_status="Success" if item["rag_records"] else "Empty",
+        answer_length=len(final_answer)
+    )
+
+    return BatchItemResult(index=item["index"], answer=final_answer, logs=item["logs"], cut_short=cut_short,
+                           **trace_fields(item["trace"]))
+
+
+def batch_error(index: int, e: Exception) -> BatchItemResult:
+    if isinstance(e, HTTPException):
+        return BatchItemResult(index=index, error=str(e.detail), status_code=e.status_code)
+    logger.error(f"Błąd zapytania wsadowego ({index}): {e}")
+    return BatchItemResult(index=index, error=str(e), status_code=500)
+
+
+def run_batch(batch: BatchQueryRequest) -> Iterator[BatchItemResult]:
+    extraction_memo = CallMemo()
+    registry_memo = CallMemo()
+    prepared = []
+
+    with ThreadPoolExecutor(max_workers=batch.max_concurrency) as executor:
+        futures = {
+            executor.submit(prepare_batch_item, i, item, extraction_memo, registry_memo): i
+            for i, item in enumerate(batch.items)
+        }
+        for future in as_completed(futures):
+            try:
+                prepared.append(future.result())
+            except Exception as e:
+                yield batch_error(futures[future], e)
+
+        rag_started = time.perf_counter()
+        rag_results = rag_system.search_records_batch([item["rag_query"] for item in prepared], k=15)
+        for item, rag_records in zip(prepared, rag_results):
+            item["rag_records"] = rag_records
+            if item["trace"] is not None:
+                item["trace"].record("rag", rag_started, detail=f"wsadowo ({len(prepared)})")
+            item["logs"].append("Kontekst RAG pobrany.")
+
+        futures = {executor.submit(finish_batch_item, item): item["index"] for item in prepared}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield batch_error(futures[future], e)
+
+
+@app.post("/ask/batch", response_model=BatchQueryResponse)
+def ask_batch_endpoint(batch: BatchQueryRequest):
+    if batch.stream:
+        return StreamingResponse(
+            (result.model_dump_json() + "\n" for result in run_batch(batch)),
+            media_type="application/x-ndjson"
+        )
+
+    results = sorted(run_batch(batch), key=lambda result: result.index)
+    return BatchQueryResponse(results=results)
+
+
+def evaluate_pair(drug_a: str, drug_b: str, mode: str) -> dict:
+    interaction = knowledge_base.find_interaction(drug_a, drug_b)
+    if interaction:
+        return {
+            "interakcja": interaction["interakcja"],
+            "severity": interaction["severity"],
+            "summary": f"{interaction['subjects']}: {interaction['effect']}",
+            "source": "knowledge"
+        }
+
+    if mode in PROVIDER_KEYS and breakers.available(mode):
+        question = f"Czy występują interakcje między lekami: {drug_a} i {drug_b}?"
+        answer = call_llm(question, knowledge_base.describe([drug_a, drug_b]), mode=mode, json_mode=True)
+        is_valid, _ = SecurityGuard.is_valid_json(answer)
+        if is_valid:
+            data = json.loads(answer)
+            return {"interakcja": data["interakcja"], "severity": None, "summary": data["answer"], "source": "llm"}
+
+        verdict = detect_verdict(answer)
+        return {
+            "interakcja": verdict == "INTERAKCJA" if verdict else None,
+            "severity": None,
+            "summary": answer,
+            "source": "llm"
+        }
+
+    return {"interakcja": None, "severity": None, "summary": "Brak danych o tej parze w lokalnej bazie.", "source": "none"}
+
+
+def check_pair(drug_a: str, drug_b: str, mode: str) -> PairResult:
+    key = (mode,) + tuple(sorted([phrase_key(drug_a), phrase_key(drug_b)]))
+    cached = pair_cache.get(key)
+    if cached is not None:
+        return PairResult(drug_a=drug_a, drug_b=drug_b, cached=True, **cached)
+
+    result = evaluate_pair(drug_a, drug_b, mode)
+    if result["interakcja"] is not None:
+        pair_cache.set(key, result)
+    return PairResult(drug_a=drug_a, drug_b=drug_b, **result)
+
+
+@app.post("/cabinet/check", response_model=CabinetResponse)
+def cabinet_check_endpoint(request: CabinetRequest):
+    drugs = []
+    seen = set()
+    for drug in request.drugs:
+        clean_drug = check_query(drug)
+        if clean_drug and phrase_key(clean_drug) not in seen:
+            seen.add(phrase_key(clean_drug))
+            drugs.append(clean_drug)
+
+    pairs_to_check = [(i, j) for i in range(len(drugs)) for j in range(i + 1, len(drugs))]
+    matrix = [[None] * len(drugs) for _ in drugs]
+    pairs = []
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = executor.map(lambda pair: check_pair(drugs[pair[0]], drugs[pair[1]], request.mode), pairs_to_check)
+        for (i, j), result in zip(pairs_to_check, results):
+            matrix[i][j] = matrix[j][i] = result.interakcja
+            pairs.append(result)
+
+    logger.info(f"Apteczka: {len(pairs)} par, z pamięci podręcznej: {sum(1 for p in pairs if p.cached)}")
+    return CabinetResponse(drugs=drugs, matrix=matrix, pairs=pairs)
+
+
+@app.post("/drugs/lookup", response_model=DrugLookupResponse)
+def drug_lookup_endpoint(request: DrugLookupRequest):
+    args = {"drug_name": request.drug_name, "drug_dose": request.drug_dose, "mode": request.mode}
+    result = registry.validate_and_execute("identify_drugs" if request.describe else "lookup_drug", args, truncate=False)
+
+    if result.startswith(REGISTRY_PREFIX):
+        return DrugLookupResponse(**json.loads(result[len(REGISTRY_PREFIX):]))
+    if result.startswith("Błąd danych"):
+        raise HTTPException(status_code=422, detail=result)
+    if result.startswith("Błąd: Przekroczono czas"):
+        raise HTTPException(status_code=504, detail=result)
+
+    try:
+        detail = json.loads(result).get("error", result)
+    except ValueError:
+        detail = result
+    if detail.startswith("Nie znaleziono"):
+        raise HTTPException(status_code=404, detail=detail)
+    raise HTTPException(status_code=503, detail=detail)
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_pipeline(request: QueryRequest, clean_query: str, logs: List[str]) -> Iterator[str]:
+    deadline = request_deadline(request)
+    trace = RequestTrace() if request.trace else None
+    with deadline.scope(), use_trace(trace):
+        potential_drugs = extract_drugs(clean_query, request.mode, logs)
+    yield sse_event("stage", {"stage": "extraction", "drugs": potential_drugs})
+
+    with deadline.scope(), use_trace(trace):
+        tool_result, all_tool_results = lookup_drugs(clean_query, potential_drugs, request, logs)
+    yield sse_event("stage", {"stage": "registry", "results": all_tool_results})
+
+    with deadline.scope(), use_trace(trace):
+        rag_records = search_rag(clean_query, all_tool_results, logs)
+    yield sse_event("stage", {"stage": "rag", "status": "Success" if rag_records else "Empty"})
+
+    verdict = None
+    final_answer = ""
+    with deadline.scope():
+        use_provider = provider_available(request.mode, logs) and stage_allowed("synthesis", SYNTHESIS_MIN_TIME)
+    synthesis_started = time.perf_counter()
+    if use_provider:
+        with use_trace(trace):
+            context = pack_context(clean_query, rag_records, tool_result, request, logs)
+        synthesis_started = time.perf_counter()
+        try:
+            for token in stream_llm(clean_query, context, mode=request.mode,
+                                    tools_schema=True, json_mode=request.json_mode, deadline=deadline):
+                final_answer += token
+                yield sse_event("token", {"text": token})
+                if verdict is None:
+                    verdict = detect_verdict(final_answer, request.json_mode)
+                    if verdict:
+                        yield sse_event("verdict", {"verdict": verdict, "interakcja": verdict == "INTERAKCJA"})
+        except Exception as e:
+            logger.error(f"Błąd syntezy: {e}")
+            if deadline.expired():
+                deadline.mark("synthesis")
+            final_answer = f"Usługa niedostępna: {str(e)}"
+            yield sse_event("error", {"detail": final_answer})
+        else:
+            if request.json_mode:
+                is_valid, err_msg = SecurityGuard.is_valid_json(final_answer)
+                repaired = repair_json_locally(final_answer, request.mode) if not is_valid else None
+                if repaired:
+                    final_answer = repaired
+                elif not is_valid:
+                    logger.info(f"Naprawa JSON (stream, {request.mode}). Błąd: {err_msg}")
+                    with deadline.scope():
+                        final_answer = call_llm(build_json_fix_prompt(err_msg, final_answer), context,
+                                                mode=request.mode, tools_schema=None, json_mode=True, retry_count=1)
+    else:
+        final_answer = local_llm_stub(clean_query, rag_system.format_records(rag_records), tool_result)
+        yield sse_event("token", {"text": final_answer})
+
+    final_answer = finalize_answer(final_answer, request.json_mode)
+    if trace is not None:
+        trace.record("synthesis", synthesis_started, detail=request.mode if use_provider else "local")
+    if verdict is None:
+        verdict = detect_verdict(final_answer, request.json_mode)
+        if verdict:
+            yield sse_event("verdict", {"verdict": verdict, "interakcja": verdict == "INTERAKCJA"})
+
+    log_to_csv(
+        query=request.query,
+        mode=request.mode,
+        drugs=potential_drugs,
+        rag_status="Success" if rag_records else "Empty",
         answer_length=len(final_answer)
     )
-    
-    return QueryResponse(answer=final_answer, logs=logs)
+
+    cut_short = report_cut_short(deadline, logs)
+    yield sse_event("done", {"answer": final_answer, "logs": logs, "cut_short": cut_short, **trace_fields(trace)})
+
+
+@app.post("/ask/stream")
+def ask_stream_endpoint(request: QueryRequest):
+    logs = [f"Zapytanie: {request.query}"]
+    clean_query = check_query(request.query)
+    logs.append("Weryfikacja bezpieczeństwa: OK")
+
+    return StreamingResponse(
+        stream_pipeline(request, clean_query, logs),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Brak uprawnień administratora.")
+
+
+@app.get("/admin/breakers")
+def admin_breakers_endpoint(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    return breakers.snapshot()
 
 
+@app.post("/admin/breakers/{name}/reset")
+def admin_breaker_reset_endpoint(name: str, x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    if name not in breakers.snapshot():
+        raise HTTPException(status_code=404, detail=f"Nieznana zależność: {name}")
+    breakers.get(name).reset()
+    return breakers.get(name).snapshot()
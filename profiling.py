@@ -0,0 +1,49 @@
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger("profiling")
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+
+_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def save_profile(profiler: cProfile.Profile, label: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(PROFILE_DIR, name + ".prof")
+    profiler.dump_stats(path)
+    with open(os.path.join(PROFILE_DIR, name + ".txt"), "w", encoding="utf-8") as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        stats.sort_stats("tottime").print_stats(PROFILE_TOP)
+    return path
+
+
+@contextmanager
+def profile_request(label: str):
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy("Profilowanie innego zapytania jest w toku.")
+    artifact = {"path": None}
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield artifact
+        finally:
+            profiler.disable()
+            artifact["path"] = save_profile(profiler, label)
+            logger.info(f"Profil zapytania zapisany: {artifact['path']}")
+    finally:
+        _lock.release()
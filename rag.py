@@ -1,28 +1,57 @@
-from sentence_transformers import SentenceTransformer
-import faiss
+import logging
 import numpy as np
 import os
+import requests
+import threading
+from typing import List
+
+from tracing import stage
+from resilience import breakers
+from deadline import remaining_timeout
+
+logger = logging.getLogger("rag")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+RAG_SERVER_URL = os.getenv("RAG_SERVER_URL")
+RAG_SERVER_MAX_QUERIES = 64
+EMBEDDING_STORAGE = os.getenv("RAG_EMBEDDING_STORAGE", "float32")
+STORAGES = ("float32", "float16", "pq")
+PQ_SUBQUANTIZERS = int(os.getenv("RAG_PQ_M", "48"))
+PQ_BITS = 8
+PQ_MIN_TRAINING = 39 * 2 ** PQ_BITS
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
 
 
 class MedicalRAG:
-    def __init__(self, knowledge_file="knowledge.txt"):
-        self.embedding_model = 'all-MiniLM-L6-v2'
+    def __init__(self, knowledge_file="knowledge.txt", storage: str = EMBEDDING_STORAGE):
+        if storage not in STORAGES:
+            raise ValueError(f"Nieznany sposób przechowywania embeddingów: {storage} (dostępne: {', '.join(STORAGES)})")
+        self.embedding_model = EMBEDDING_MODEL
+        self.storage = storage
         self._model = None
         self.knowledge_file = knowledge_file
         self.chunks = []
         self.index = None
-        self.all_embeddings = None
         self.MAX_CONTEXT_CHARS = 3000
+        self._index_lock = threading.Lock()
 
     @property
     def model(self):
         if self._model is None:
+            from sentence_transformers import SentenceTransformer
             self._model = SentenceTransformer(self.embedding_model)
         return self._model
 
     def _ensure_indexed(self):
         if self.index is None:
-            self._build_index()
+            with self._index_lock:
+                if self.index is None:
+                    self._build_index()
 
     def _build_index(self):
         if not os.path.exists(self.knowledge_file):
@@ -36,36 +65,70 @@ class MedicalRAG:
         if not self.chunks:
             return
 
-        embeddings = self.model.encode(self.chunks, show_progress_bar=False)
-        self.all_embeddings = np.array(embeddings).astype('float32')
-        dimension = self.all_embeddings.shape[1]
-
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(self.all_embeddings)
+        with stage("rag_index_build"):
+            embeddings = self.model.encode(self.chunks, show_progress_bar=False)
+            self.index = self.build_index(normalize_rows(embeddings))
+
+    def build_index(self, embeddings: np.ndarray):
+        import faiss
+        count, dimension = embeddings.shape
+        storage = self.storage
+        if storage == "pq" and (count < PQ_MIN_TRAINING or dimension % PQ_SUBQUANTIZERS):
+            logger.warning(f"Za mało wpisów ({count}) lub wymiar {dimension} niepodzielny przez RAG_PQ_M={PQ_SUBQUANTIZERS}, używam float16 zamiast pq")
+            storage = "float16"
+
+        if storage == "pq":
+            index = faiss.IndexPQ(dimension, PQ_SUBQUANTIZERS, PQ_BITS, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+        elif storage == "float16":
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexFlatIP(dimension)
+        index.add(embeddings)
+        return index
 
     def search(self, query: str, k: int = 5, lambda_param: float = 0.5) -> str:
+        return self.search_batch([query], k=k, lambda_param=lambda_param)[0]
+
+    def search_batch(self, queries: List[str], k: int = 5, lambda_param: float = 0.5) -> List[str]:
+        return [self.format_records(records) for records in self.search_records_batch(queries, k, lambda_param)]
+
+    def search_records(self, query: str, k: int = 5, lambda_param: float = 0.5) -> List[dict]:
+        return self.search_records_batch([query], k=k, lambda_param=lambda_param)[0]
+
+    def search_records_batch(self, queries: List[str], k: int = 5, lambda_param: float = 0.5) -> List[List[dict]]:
         self._ensure_indexed()
-        if not self.index or not self.chunks:
-            return ""
+        if not self.index or not self.chunks or not queries:
+            return [[] for _ in queries]
+
+        with stage("rag_encode"):
+            query_vectors = normalize_rows(self.model.encode(queries, show_progress_bar=False))
 
-        query_vector = self.model.encode([query])
-        query_vector = np.array(query_vector).astype('float32')
-        
         fetch_k = min(2 * k, len(self.chunks))
-        distances, indices = self.index.search(query_vector, fetch_k)
-        
-        selected_indices = self._mmr(query_vector, indices[0], k, lambda_param)
+        with stage("rag_index_search"):
+            similarities, indices = self.index.search(query_vectors, fetch_k)
 
+        results = []
+        for i in range(len(queries)):
+            scores = dict(zip(indices[i], similarities[i]))
+            with stage("rag_mmr"):
+                selected_indices = self._mmr(query_vectors[i:i + 1], indices[i], k, lambda_param)
+            results.append([
+                {"id": int(idx), "text": self.chunks[idx], "score": float(scores.get(idx, 0.0))}
+                for idx in selected_indices if idx < len(self.chunks)
+            ])
+        return results
+
+    def format_records(self, records: List[dict]) -> str:
         results = []
         current_length = 0
-        for idx in selected_indices:
-            if idx < len(self.chunks):
-                chunk_text = f"[Źródło ID:{idx}] {self.chunks[idx]}"
-                if current_length + len(chunk_text) + 1 > self.MAX_CONTEXT_CHARS:
-                    results.append("... [Kontekst RAG przycięty ze względu na limit długości]")
-                    break
-                results.append(chunk_text)
-                current_length += len(chunk_text) + 1
+        for record in records:
+            chunk_text = f"[Źródło ID:{record['id']}] {record['text']}"
+            if current_length + len(chunk_text) + 1 > self.MAX_CONTEXT_CHARS:
+                results.append("... [Kontekst RAG przycięty ze względu na limit długości]")
+                break
+            results.append(chunk_text)
+            current_length += len(chunk_text) + 1
 
         return "\n".join(results)
 
@@ -77,12 +140,9 @@ class MedicalRAG:
         if not valid_indices:
             return []
 
-        candidate_embeddings = self.all_embeddings[valid_indices]
-        
-        query_norm = query_vector / np.linalg.norm(query_vector)
-        candidate_norms = candidate_embeddings / np.linalg.norm(candidate_embeddings, axis=1, keepdims=True)
+        candidate_norms = self.index.reconstruct_batch(np.array(valid_indices, dtype="int64"))
         
-        similarities_to_query = np.dot(candidate_norms, query_norm.T).flatten()
+        similarities_to_query = np.dot(candidate_norms, query_vector.T).flatten()
         
         selected_indices = []
         selected_embeddings = []
@@ -111,4 +171,39 @@ class MedicalRAG:
         return selected_indices
 
 
-rag_system = MedicalRAG()
+class RemoteRAG(MedicalRAG):
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def _ensure_indexed(self):
+        pass
+
+    def search_records_batch(self, queries: List[str], k: int = 5, lambda_param: float = 0.5) -> List[List[dict]]:
+        results = []
+        for start in range(0, len(queries), RAG_SERVER_MAX_QUERIES):
+            results.extend(self._search_remote(queries[start:start + RAG_SERVER_MAX_QUERIES], k, lambda_param))
+        return results
+
+    def _search_remote(self, queries: List[str], k: int, lambda_param: float) -> List[List[dict]]:
+        def fetch():
+            response = self.session.post(
+                f"{self.url}/search",
+                json={"queries": queries, "k": k, "lambda_param": lambda_param},
+                timeout=remaining_timeout(breakers.timeout("rag"))
+            )
+            if response.status_code >= 500:
+                response.raise_for_status()
+            return response
+
+        try:
+            with stage("rag_remote"):
+                response = breakers.call("rag", fetch)
+            response.raise_for_status()
+            return response.json()["results"]
+        except Exception as e:
+            logger.error(f"Błąd zapytania do serwera RAG ({self.url}): {e}")
+            return [[] for _ in queries]
+
+rag_system = RemoteRAG(RAG_SERVER_URL) if RAG_SERVER_URL else MedicalRAG()
@@ -0,0 +1,45 @@
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from metrics import metrics
+from rag import RAG_SERVER_MAX_QUERIES, MedicalRAG
+
+rag = MedicalRAG()
+
+
+class SearchRequest(BaseModel):
+    queries: List[str] = Field(..., max_length=RAG_SERVER_MAX_QUERIES)
+    k: int = Field(5, ge=1, le=50)
+    lambda_param: float = Field(0.5, ge=0.0, le=1.0)
+
+
+class SearchResponse(BaseModel):
+    results: List[List[dict]]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    rag._ensure_indexed()
+    yield
+
+
+app = FastAPI(title="KnowYourPill RAG", lifespan=lifespan)
+
+
+@app.post("/search", response_model=SearchResponse)
+def search_endpoint(request: SearchRequest):
+    return SearchResponse(results=rag.search_records_batch(request.queries, k=request.k, lambda_param=request.lambda_param))
+
+
+@app.get("/health")
+def health_endpoint():
+    return {"chunks": len(rag.chunks), "indexed": rag.index is not None}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+from deadline import remaining_timeout
+from metrics import metrics
+
+logger = logging.getLogger("ratelimit")
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+APPROX_CHARS_PER_TOKEN = 3
+MAX_QUEUE = int(os.getenv("RATE_LIMIT_QUEUE_SIZE", "100"))
+MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))
+
+PROVIDER_LIMITS = {
+    "groq": (float(os.getenv("GROQ_RPM", "30")), float(os.getenv("GROQ_TPM", "12000"))),
+    "gemini": (float(os.getenv("GEMINI_RPM", "15")), float(os.getenv("GEMINI_TPM", "1000000"))),
+}
+
+queue_depth = metrics.gauge(
+    "knowyourpill_ratelimit_queue_depth",
+    "Liczba wywołań oczekujących na limit dostawcy",
+    ("provider", "model")
+)
+queue_wait = metrics.histogram(
+    "knowyourpill_ratelimit_wait_seconds",
+    "Czas oczekiwania wywołania na limit dostawcy",
+    ("provider", "model", "priority")
+)
+queue_rejections = metrics.counter(
+    "knowyourpill_ratelimit_rejections_total",
+    "Wywołania odrzucone przez limiter (pełna kolejka lub przekroczony czas oczekiwania)",
+    ("provider", "model", "reason")
+)
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def estimate_tokens(prompt: str, max_output_tokens: int = 0) -> int:
+    return (len(prompt) + APPROX_CHARS_PER_TOKEN - 1) // APPROX_CHARS_PER_TOKEN + max_output_tokens
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+class ProviderLimiter:
+    def __init__(self, provider: str, model: str, rpm: float, tpm: float, max_queue: int = MAX_QUEUE):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_queue = max_queue
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _wait_time(self, tokens: int) -> float:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def _take(self, tokens: int):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def _observe(self, started: float, priority: int):
+        queue_wait.observe(time.monotonic() - started, provider=self.provider, model=self.model,
+                           priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+    def acquire(self, tokens: int, priority: int = INTERACTIVE, max_wait: float = MAX_WAIT) -> float:
+        started = time.monotonic()
+        with self._cond:
+            if not self._waiters and self._wait_time(tokens) == 0:
+                self._take(tokens)
+                self._observe(started, priority)
+                return 0.0
+
+            if len(self._waiters) >= self.max_queue:
+                queue_rejections.inc(provider=self.provider, model=self.model, reason="queue_full")
+                raise RateLimitError(f"Limit zapytań {self.provider} ({self.model}): kolejka pełna.")
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            queue_depth.set(len(self._waiters), provider=self.provider, model=self.model)
+            try:
+                while True:
+                    wait = self._wait_time(tokens) if self._waiters[0] == entry else None
+                    if wait == 0:
+                        break
+                    remaining = max_wait - (time.monotonic() - started)
+                    if remaining <= 0 or (wait is not None and wait > remaining):
+                        queue_rejections.inc(provider=self.provider, model=self.model, reason="timeout")
+                        raise RateLimitError(f"Limit zapytań {self.provider} ({self.model}): przekroczono czas oczekiwania.")
+                    self._cond.wait(remaining if wait is None else wait)
+                self._take(tokens)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                queue_depth.set(len(self._waiters), provider=self.provider, model=self.model)
+                self._cond.notify_all()
+
+        self._observe(started, priority)
+        waited = time.monotonic() - started
+        if waited > 1:
+            logger.info(f"Limiter {self.provider}/{self.model}: oczekiwanie {waited:.1f}s ({PRIORITY_NAMES.get(priority)})")
+        return waited
+
+
+class LimiterRegistry:
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: str) -> ProviderLimiter:
+        with self._lock:
+            key = (provider, model)
+            if key not in self._limiters:
+                prefix = f"{provider}_{model}".upper().replace("-", "_").replace(".", "_")
+                rpm, tpm = PROVIDER_LIMITS.get(provider, (60.0, 100000.0))
+                rpm = float(os.getenv(f"{prefix}_RPM", rpm))
+                tpm = float(os.getenv(f"{prefix}_TPM", tpm))
+                self._limiters[key] = ProviderLimiter(provider, model, rpm, tpm)
+            return self._limiters[key]
+
+    def acquire(self, provider: str, model: str, prompt: str, max_output_tokens: int = 0, priority: int = INTERACTIVE) -> float:
+        return self.get(provider, model).acquire(estimate_tokens(prompt, max_output_tokens), priority=priority,
+                                                 max_wait=remaining_timeout(MAX_WAIT))
+
+
+limiters = LimiterRegistry()
@@ -0,0 +1,199 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger("resilience")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+RECOVERY_TIME = float(os.getenv("BREAKER_RECOVERY_SECONDS", "30"))
+LATENCY_WINDOW = int(os.getenv("BREAKER_LATENCY_WINDOW", "200"))
+MIN_LATENCY_SAMPLES = int(os.getenv("BREAKER_MIN_SAMPLES", "20"))
+TIMEOUT_PERCENTILE = float(os.getenv("ADAPTIVE_TIMEOUT_PERCENTILE", "0.99"))
+TIMEOUT_MULTIPLIER = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "1.5"))
+
+TIMEOUTS = {
+    "registry": (float(os.getenv("REGISTRY_TIMEOUT", "5")), float(os.getenv("REGISTRY_MIN_TIMEOUT", "1"))),
+    "groq": (float(os.getenv("GROQ_TIMEOUT", "60")), float(os.getenv("GROQ_MIN_TIMEOUT", "5"))),
+    "gemini": (float(os.getenv("GEMINI_TIMEOUT", "60")), float(os.getenv("GEMINI_MIN_TIMEOUT", "5"))),
+    "rag": (float(os.getenv("RAG_SERVER_TIMEOUT", "10")), float(os.getenv("RAG_SERVER_MIN_TIMEOUT", "1"))),
+}
+
+breaker_transitions = metrics.counter(
+    "knowyourpill_breaker_transitions_total",
+    "Zmiany stanu bezpieczników zależności zewnętrznych",
+    ("dependency", "state")
+)
+dependency_calls = metrics.counter(
+    "knowyourpill_dependency_calls_total",
+    "Wywołania zależności zewnętrznych (rejestr, Groq, Gemini) według wyniku",
+    ("dependency", "outcome")
+)
+dependency_latency = metrics.histogram(
+    "knowyourpill_dependency_latency_seconds",
+    "Czas udanych wywołań zależności zewnętrznych",
+    ("dependency",)
+)
+breaker_rejections = metrics.counter(
+    "knowyourpill_breaker_rejections_total",
+    "Wywołania odrzucone bez kontaktu z zależnością (otwarty bezpiecznik)",
+    ("dependency",)
+)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Zależność '{name}' chwilowo niedostępna (otwarty bezpiecznik).")
+        self.name = name
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, max_timeout: float, min_timeout: float,
+                 failure_threshold: int = FAILURE_THRESHOLD, recovery_time: float = RECOVERY_TIME):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min_timeout
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self._probe = False
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning(f"Bezpiecznik {self.name}: {self.state} -> {state}")
+            self.state = state
+            breaker_transitions.inc(dependency=self.name, state=state)
+
+    def available(self) -> bool:
+        return self.state != OPEN or time.time() - self.opened_at >= self.recovery_time
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.recovery_time:
+                self._transition(HALF_OPEN)
+                self._probe = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe:
+                self._probe = True
+                return True
+        breaker_rejections.inc(dependency=self.name)
+        return False
+
+    def before(self):
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+
+    def success(self, latency: Optional[float] = None):
+        dependency_calls.inc(dependency=self.name, outcome="success")
+        if latency is not None:
+            dependency_latency.observe(latency, dependency=self.name)
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            self.failures = 0
+            self._probe = False
+            if self.state != OPEN:
+                self._transition(CLOSED)
+
+    def failure(self, error: Optional[Exception] = None):
+        dependency_calls.inc(dependency=self.name, outcome="failure")
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error else None
+            self._probe = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                self._transition(OPEN)
+
+    def release(self):
+        with self._lock:
+            self._probe = False
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self._probe = False
+            self._transition(CLOSED)
+
+    def percentile(self, q: float) -> Optional[float]:
+        samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def timeout(self) -> float:
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return self.max_timeout
+        adaptive = self.percentile(TIMEOUT_PERCENTILE) * TIMEOUT_MULTIPLIER
+        return max(self.min_timeout, min(self.max_timeout, adaptive))
+
+    def call(self, func: Callable, *args, **kwargs):
+        self.before()
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self.failure(e)
+            else:
+                self.release()
+            raise
+        self.success(time.perf_counter() - started)
+        return result
+
+    def snapshot(self) -> dict:
+        p50, p99 = self.percentile(0.5), self.percentile(0.99)
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "retry_in": round(max(0.0, self.recovery_time - (time.time() - self.opened_at)), 1) if self.state == OPEN else 0.0,
+            "timeout": round(self.timeout(), 3),
+            "latency_samples": len(self._latencies),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p99": round(p99, 3) if p99 is not None else None,
+        }
+
+
+class BreakerRegistry:
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            if name not in self._breakers:
+                max_timeout, min_timeout = TIMEOUTS.get(name, (30.0, 1.0))
+                self._breakers[name] = CircuitBreaker(name, max_timeout=max_timeout, min_timeout=min_timeout)
+            return self._breakers[name]
+
+    def available(self, name: str) -> bool:
+        return self.get(name).available()
+
+    def timeout(self, name: str) -> float:
+        return self.get(name).timeout()
+
+    def call(self, name: str, func: Callable, *args, **kwargs):
+        return self.get(name).call(func, *args, **kwargs)
+
+    def snapshot(self) -> Dict[str, dict]:
+        for name in TIMEOUTS:
+            self.get(name)
+        return {name: breaker.snapshot() for name, breaker in sorted(self._breakers.items())}
+
+
+breakers = BreakerRegistry()
@@ -2,24 +2,44 @@ import requests
 import json
 import os
 import re
+import sys
 from difflib import SequenceMatcher
 from pydantic import BaseModel, Field, ValidationError
-from func_timeout import func_timeout, FunctionTimedOut
 from typing import Dict, Any, Type, List, Optional
 import logging
-from google import genai
-from google.genai import errors
-from dotenv import load_dotenv
 
-load_dotenv(dotenv_path=".env.local")
-load_dotenv()
+from cache import TTLCache
+from metrics import metrics
+from tracing import annotate, stage
+from resilience import CircuitOpenError, breakers
+from ratelimit import BACKGROUND, limiters
+from deadline import Deadline, DeadlineExceeded, get_deadline, mark_if_expired, remaining_timeout, stage_allowed
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("tools")
 
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT_MS", "5000")) / 1000
+RPL_API_URL = os.getenv("RPL_API_URL", "https://rejestry.ezdrowie.gov.pl/api/rpl/medicinal-products/search/public")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+REGISTRY_PREFIX = "Dane z Rejestru: "
+
+registry_cache = TTLCache(
+    max_size=int(os.getenv("REGISTRY_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("REGISTRY_CACHE_TTL", str(7 * 24 * 3600))),
+    path=os.getenv("REGISTRY_CACHE_FILE", "registry_cache.json"),
+    name="registry"
+)
+registry_requests = metrics.counter(
+    "knowyourpill_registry_requests_total",
+    "Zapytania HTTP do rejestru według kroku kaskady wyszukiwania",
+    ("step",)
+)
+
 
 def handle_genai_error(e: Exception) -> str:
-    if isinstance(e, errors.APIError):
+    errors = sys.modules.get("google.genai.errors")
+    if errors is not None and isinstance(e, errors.APIError):
         if e.status == "RESOURCE_EXHAUSTED":
             return "Przekroczono limit zapytań do serwera. Spróbuj ponownie później."
         if e.status == "NOT_FOUND":
@@ -32,20 +52,49 @@ def handle_genai_error(e: Exception) -> str:
     return f"Wystąpił błąd: {str(e)}"
 
 
+def provider_timeout(name: str) -> float:
+    return remaining_timeout(breakers.timeout(name))
+
+
+def gemini_http_options():
+    from google.genai import types
+    return types.HttpOptions(base_url=GEMINI_BASE_URL, timeout=int(provider_timeout("gemini") * 1000))
+
+
+def registry_get(params: dict, step: str) -> requests.Response:
+    timeout = provider_timeout("registry")
+    registry_requests.inc(step=step)
+
+    def fetch():
+        response = requests.get(RPL_API_URL, params=params, timeout=timeout)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    with stage("registry_request", detail=step):
+        return breakers.call("registry", fetch)
+
+
+@stage("description")
 def get_drug_description(substance: str, mode: str = "groq") -> str:
     actual_mode = "groq" if mode == "local" else mode
     
     api_key = os.getenv("GROQ_API_KEY") if actual_mode == "groq" else os.getenv("GEMINI_API_KEY")
     if not api_key:
         return "Brak opisu (brak klucza API)."
+    if not stage_allowed("description"):
+        return "Brak opisu (przekroczono czas odpowiedzi)."
 
     prompt = f"Podaj krótki (2-3 zdania), profesjonalny opis leku/substancji czynnej: {substance}. Skup się na głównym zastosowaniu i mechanizmie działania. Nie używaj formatowania Markdown (pogrubień, list), napisz czysty tekst."
 
     try:
         if actual_mode == "groq":
             from groq import Groq
-            client = Groq(api_key=api_key)
-            completion = client.chat.completions.create(
+            client = Groq(api_key=api_key, timeout=provider_timeout("groq"))
+            limiters.acquire("groq", "llama-3.3-70b-versatile", prompt, 256, priority=BACKGROUND)
+            completion = breakers.call(
+                "groq",
+                client.chat.completions.create,
                 model="llama-3.3-70b-versatile",
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.2,
@@ -53,14 +102,20 @@ def get_drug_description(substance: str, mode: str = "groq") -> str:
             )
             return completion.choices[0].message.content.strip()
         else:
-            client = genai.Client(api_key=api_key)
-            response = client.models.generate_content(
+            from google import genai
+            client = genai.Client(api_key=api_key, http_options=gemini_http_options())
+            limiters.acquire("gemini", "gemini-2.0-flash", prompt, 256, priority=BACKGROUND)
+            response = breakers.call(
+                "gemini",
+                client.models.generate_content,
                 model='gemini-2.0-flash',
                 contents=prompt
             )
             return response.text.strip()
     except Exception as e:
         logger.error(f"Błąd {actual_mode} przy generowaniu opisu: {e}")
+        if mark_if_expired("description"):
+            return "Brak opisu (przekroczono czas odpowiedzi)."
         if actual_mode == "groq" and mode == "local":
             logger.info("Próba fallback na Gemini dla opisu...")
             return get_drug_description(substance, mode="gemini")
@@ -76,24 +131,106 @@ class IdentifyDrugArgs(BaseModel):
     mode: str = "groq"
 
 
-def identify_drugs_impl(drug_name: str, drug_dose: Optional[str] = None, mode: str = "groq") -> str:
-    url = "https://rejestry.ezdrowie.gov.pl/api/rpl/medicinal-products/search/public"
+def score_candidate(target_name_lower: str, target_dose_lower: str, target_dose_simple: str, res: dict) -> int:
+    score = 0
+    res_name = res.get('medicinalProductName', '').lower()
+    res_substance = res.get('commonName', '').lower()
+    res_power = res.get('medicinalProductPower', '').lower()
+    res_power_normalized = res_power.replace(" ", "")
+    res_power_simple = res_power_normalized.replace("mg", "").replace("ml", "").replace("g", "").replace("µg", "").replace(",", ".")
+
+    similarity = SequenceMatcher(None, target_name_lower, res_name).ratio()
     
+    if target_name_lower == res_name:
+        score += 300
+    elif res_name.startswith(target_name_lower + " "):
+        score += 250
+    elif similarity > 0.9:
+        score += int(similarity * 250)
+    elif target_name_lower in res_name:
+        if re.search(r'\b' + re.escape(target_name_lower) + r'\b', res_name):
+            score += 200
+        else:
+            score += 100
+    elif similarity > 0.7:
+        score += int(similarity * 150)
+
+
+    substance_similarity = SequenceMatcher(None, target_name_lower, res_substance).ratio()
+    if target_name_lower == res_substance:
+        score += 150
+    elif substance_similarity > 0.8:
+        score += int(substance_similarity * 80)
+    elif target_name_lower in res_substance or res_substance in target_name_lower:
+        score += 60
 
-    scored_results = []
+
+    if "+" not in target_name_lower and "+" not in target_dose_lower:
+        if "+" not in res_substance and "+" not in res_power:
+            score += 50
+
+
+    if target_dose_lower:
+
+        target_numbers = re.findall(r'\d+[.,]?\d*', target_dose_simple)
+        res_numbers = re.findall(r'\d+[.,]?\d*', res_power_simple)
+
+
+        if target_numbers:
+            match_count = 0
+            temp_res_numbers = [float(n.replace(",", ".")) for n in res_numbers]
+            for tn in target_numbers:
+                tn_normalized = tn.replace(",", ".")
+                tn_f = float(tn_normalized)
+                for i, rn_f in enumerate(temp_res_numbers):
+
+                    if abs(tn_f - rn_f) < 0.01:
+                        match_count += 1
+                        temp_res_numbers.pop(i)
+                        break
+
+
+            if match_count == len(target_numbers) and len(target_numbers) == len(res_numbers):
+                score += 200
+            elif match_count > 0:
+                score += 40 * match_count
+
+
+        if target_dose_lower in res_power_normalized or target_dose_simple in res_power_simple:
+            score += 80
+
+    return score
+
+
+def best_candidate(drug_name: str, drug_dose: Optional[str], results: List[dict]) -> dict:
     target_name_lower = drug_name.lower()
-    
+    target_dose_lower = drug_dose.lower().replace(" ", "") if drug_dose else ""
+    target_dose_simple = target_dose_lower.replace("mg", "").replace("ml", "").replace("g", "").replace("µg", "").replace(",", ".")
+
+    scored_results = [(score_candidate(target_name_lower, target_dose_lower, target_dose_simple, res), res) for res in results]
+    scored_results.sort(key=lambda x: x[0], reverse=True)
+    return scored_results[0][1]
+
+
+@stage("identify_drugs")
+def identify_drugs_impl(drug_name: str, drug_dose: Optional[str] = None, mode: str = "groq", describe: bool = True) -> str:
+    cache_key = f"{drug_name.lower()}|{(drug_dose or '').lower()}|{mode if describe else 'registry'}"
+    cached = registry_cache.get(cache_key)
+    if cached is not None:
+        annotate(cached=True)
+        return cached
+
     params = {"name": drug_name, "page": 0, "size": 25}
         
     try:
-        response = requests.get(url, params=params, timeout=5)
+        response = registry_get(params, "name")
         response.raise_for_status()
         data = response.json()
         results = data.get('content', []) if isinstance(data, dict) else []
 
         if not results:
             params = {"commonName": drug_name, "page": 0, "size": 25}
-            response = requests.get(url, params=params, timeout=5)
+            response = registry_get(params, "common_name")
             data = response.json()
             results = data.get('content', []) if isinstance(data, dict) else []
 
@@ -101,95 +238,20 @@ def identify_drugs_impl(drug_name: str, drug_dose: Optional[str] = None, mode: s
             if not results and len(drug_name) >= 4:
                 search_term = drug_name[:-1] if len(drug_name) > 4 else drug_name
                 params["name"] = search_term
-                response = requests.get(url, params=params, timeout=5)
+                response = registry_get(params, "prefix")
                 data = response.json()
                 results = data.get('content', []) if isinstance(data, dict) else []
 
                 if not results and len(drug_name) >= 3:
                     params["name"] = drug_name[:3]
-                    response = requests.get(url, params=params, timeout=5)
+                    response = registry_get(params, "short_prefix")
                     data = response.json()
                     results = data.get('content', []) if isinstance(data, dict) else []
 
         if not results:
             return json.dumps({"error": f"Nie znaleziono leku '{drug_name}' w oficjalnym rejestrze."})
 
-        target_dose_lower = drug_dose.lower().replace(" ", "") if drug_dose else ""
-        target_dose_simple = target_dose_lower.replace("mg", "").replace("ml", "").replace("g", "").replace("µg", "").replace(",", ".")
-
-        for res in results:
-            score = 0
-            res_name = res.get('medicinalProductName', '').lower()
-            res_substance = res.get('commonName', '').lower()
-            res_power = res.get('medicinalProductPower', '').lower()
-            res_power_normalized = res_power.replace(" ", "")
-            res_power_simple = res_power_normalized.replace("mg", "").replace("ml", "").replace("g", "").replace("µg", "").replace(",", ".")
-
-            similarity = SequenceMatcher(None, target_name_lower, res_name).ratio()
-            
-            if target_name_lower == res_name:
-                score += 300
-            elif res_name.startswith(target_name_lower + " "):
-                score += 250
-            elif similarity > 0.9:
-                score += int(similarity * 250)
-            elif target_name_lower in res_name:
-                if re.search(r'\b' + re.escape(target_name_lower) + r'\b', res_name):
-                    score += 200
-                else:
-                    score += 100
-            elif similarity > 0.7:
-                score += int(similarity * 150)
-
-
-            substance_similarity = SequenceMatcher(None, target_name_lower, res_substance).ratio()
-            if target_name_lower == res_substance:
-                score += 150
-            elif substance_similarity > 0.8:
-                score += int(substance_similarity * 80)
-            elif target_name_lower in res_substance or res_substance in target_name_lower:
-                score += 60
-
-
-            if "+" not in target_name_lower and "+" not in target_dose_lower:
-                if "+" not in res_substance and "+" not in res_power:
-                    score += 50
-
-
-            if target_dose_lower:
-
-                target_numbers = re.findall(r'\d+[.,]?\d*', target_dose_simple)
-                res_numbers = re.findall(r'\d+[.,]?\d*', res_power_simple)
-
-
-                if target_numbers:
-                    match_count = 0
-                    temp_res_numbers = [float(n.replace(",", ".")) for n in res_numbers]
-                    for tn in target_numbers:
-                        tn_normalized = tn.replace(",", ".")
-                        tn_f = float(tn_normalized)
-                        for i, rn_f in enumerate(temp_res_numbers):
-
-                            if abs(tn_f - rn_f) < 0.01:
-                                match_count += 1
-                                temp_res_numbers.pop(i)
-                                break
-
-
-                    if match_count == len(target_numbers) and len(target_numbers) == len(res_numbers):
-                        score += 200
-                    elif match_count > 0:
-                        score += 40 * match_count
-
-
-                if target_dose_lower in res_power_normalized or target_dose_simple in res_power_simple:
-                    score += 80
-
-            scored_results.append((score, res))
-
-
-        scored_results.sort(key=lambda x: x[0], reverse=True)
-        best_match = scored_results[0][1]
+        best_match = best_candidate(drug_name, drug_dose, results)
 
         name = best_match.get('medicinalProductName', best_match.get('name', 'N/A'))
         substance = best_match.get('commonName', best_match.get('activeSubstanceName', 'Nieznana substancja'))
@@ -197,7 +259,7 @@ def identify_drugs_impl(drug_name: str, drug_dose: Optional[str] = None, mode: s
         form = best_match.get('pharmaceuticalFormName', '')
         atc = best_match.get('atcCode', '')
 
-        indications = get_drug_description(substance, mode=mode)
+        indications = get_drug_description(substance, mode=mode) if describe else None
 
         result_data = {
             "name": name,
@@ -208,16 +270,26 @@ def identify_drugs_impl(drug_name: str, drug_dose: Optional[str] = None, mode: s
             "indications": indications
         }
 
-        return "Dane z Rejestru: " + json.dumps(result_data, ensure_ascii=False)
+        result = REGISTRY_PREFIX + json.dumps(result_data, ensure_ascii=False)
+        registry_cache.set(cache_key, result)
+        return result
 
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        mark_if_expired("registry")
+        return json.dumps({"error": f"Rejestr chwilowo niedostępny: {str(e)}"})
     except requests.exceptions.RequestException as e:
         logger.error(f"Błąd sieci: {e}")
+        mark_if_expired("registry")
         return json.dumps({"error": f"Błąd połączenia z rejestrem: {str(e)}"})
     except Exception as e:
         logger.error(f"Nieoczekiwany błąd: {e}")
         return json.dumps({"error": f"Błąd: {str(e)}"})
 
 
+def lookup_drug_impl(drug_name: str, drug_dose: Optional[str] = None, mode: str = "groq") -> str:
+    return identify_drugs_impl(drug_name, drug_dose, mode, describe=False)
+
+
 class ToolRegistry:
     MAX_RESPONSE_CHARS = 2000
 
@@ -226,10 +298,14 @@ class ToolRegistry:
             "identify_drugs": {
                 "func": identify_drugs_impl,
                 "args_model": IdentifyDrugArgs
+            },
+            "lookup_drug": {
+                "func": lookup_drug_impl,
+                "args_model": IdentifyDrugArgs
             }
         }
 
-    def validate_and_execute(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+    def validate_and_execute(self, tool_name: str, arguments: Dict[str, Any], truncate: bool = True) -> str:
         if tool_name not in self._tools:
             raise ValueError(f"Narzędzie '{tool_name}' niedozwolone.")
 
@@ -241,19 +317,18 @@ class ToolRegistry:
             logger.warning(f"Błąd walidacji: {e}")
             return f"Błąd danych: {e.errors()[0]['msg']}"
 
+        parent = get_deadline()
+        deadline = parent.child(TOOL_TIMEOUT) if parent else Deadline(TOOL_TIMEOUT)
         try:
-            result = func_timeout(
-                5.0,
-                tool_def["func"],
-                kwargs=validated_args.model_dump()
-            )
-            
-            if isinstance(result, str) and len(result) > self.MAX_RESPONSE_CHARS:
+            with deadline.scope():
+                result = tool_def["func"](**validated_args.model_dump())
+
+            if truncate and isinstance(result, str) and len(result) > self.MAX_RESPONSE_CHARS:
                 logger.warning(f"Przycięto wynik narzędzia {tool_name} z {len(result)} do {self.MAX_RESPONSE_CHARS} znaków.")
                 return result[:self.MAX_RESPONSE_CHARS] + "... [Wynik przycięty]"
                 
             return result
-        except FunctionTimedOut:
+        except DeadlineExceeded:
             logger.error(f"Timeout narzędzia {tool_name}")
             return "Błąd: Przekroczono czas oczekiwania."
         except Exception as e:
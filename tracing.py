@@ -0,0 +1,115 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from metrics import stage_seconds
+
+_trace = ContextVar("trace", default=None)
+_span = ContextVar("span", default=None)
+
+
+class RequestTrace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def record(self, name: str, started: float, **attrs):
+        span = {
+            "stage": name,
+            "parent": None,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "cached": None,
+            "tokens": None,
+            "detail": None
+        }
+        span.update(attrs)
+        self.add(span)
+
+    def total_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def timings(self) -> Dict[str, float]:
+        timings = {}
+        for span in self.spans:
+            if span["parent"] is None:
+                timings[span["stage"]] = round(timings.get(span["stage"], 0.0) + span["duration_ms"], 2)
+        timings["total"] = self.total_ms()
+        return timings
+
+    def export(self) -> List[dict]:
+        with self._lock:
+            return sorted(self.spans, key=lambda s: s["start_ms"])
+
+    @contextmanager
+    def scope(self):
+        token = _trace.set(self)
+        try:
+            yield self
+        finally:
+            _trace.reset(token)
+
+
+def get_trace() -> Optional[RequestTrace]:
+    return _trace.get()
+
+
+@contextmanager
+def use_trace(trace: Optional[RequestTrace]):
+    if trace is None:
+        yield None
+        return
+    with trace.scope():
+        yield trace
+
+
+@contextmanager
+def stage(name: str, **attrs):
+    started = time.perf_counter()
+    trace = _trace.get()
+    if trace is None:
+        try:
+            yield None
+        finally:
+            stage_seconds.observe(time.perf_counter() - started, stage=name)
+        return
+
+    parent = _span.get()
+    span = {
+        "stage": name,
+        "parent": parent["stage"] if parent else None,
+        "start_ms": round((started - trace.started) * 1000, 2),
+        "duration_ms": 0.0,
+        "cached": None,
+        "tokens": None,
+        "detail": None
+    }
+    span.update(attrs)
+    token = _span.set(span)
+    try:
+        yield span
+    finally:
+        _span.reset(token)
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=name)
+        span["duration_ms"] = round(elapsed * 1000, 2)
+        trace.add(span)
+
+
+def annotate(**attrs):
+    span = _span.get()
+    if span is not None:
+        span.update({k: v for k, v in attrs.items() if v is not None})
+
+
+def add_tokens(count: Optional[int]):
+    span = _span.get()
+    if span is not None and count:
+        span["tokens"] = (span["tokens"] or 0) + count